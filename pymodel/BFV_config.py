@@ -1,17 +1,28 @@
 # BFV_config.py
 import numpy as np
-from generic_math import is_prime, is_t_minus_1_multiple_of_2n, batch_encode_decode_matrices, is_power_of_2, gen_RNS_basis, RNSInteger, compute_CRT_coefficients
-import sympy
+from generic_math import is_prime, is_t_minus_1_multiple_of_2n, batch_encode_decode_matrices, batch_encoding_root, bit_reverse_perm, is_power_of_2, gen_RNS_basis, RNSInteger, compute_CRT_coefficients
+from ntt import NegacyclicNTT, get_ntt_engine, register_psi, known_psi
+from rns_polynomial import RNSBasis, RNSPolynomial
+from base_conversion import conversion_cache, get_fastBconv, get_modswitch, get_fastBconvEx, get_scale_down, get_scale_and_round, get_crt_reconstruction
+import param_cache
 import math
 import copy
 
+# conversion cache entries of one modulus chain level: the 9 built by _populate_conversion_cache (with the ones
+# nested in the fused scale-down) and the modswitch of mod_switch_down, with room to spare
+_CONVERSIONS_PER_LEVEL = 16
+
 class BFVSchemeConfiguration:
-    def __init__(self, t: int, desired_q_numbits: int, n: int, ternary: bool = True):
+    def __init__(self, t: int, desired_q_numbits: int, n: int, ternary: bool = True, use_param_cache: bool = True, param_cache_dir: str = None, leveled: bool = False):
         """
         :param t: Plaintext modulus (prime or power of prime)
         :param desired_q_numbits: Ciphertext modulus (t divides q, q much larger than t)
         :param n: Degree of polynomial + 1
         :param ternary: If true, secret key is ternary {-1,0,1}, else binary {0,1}
+        :param use_param_cache: If true, load/store the derived RNS bases and roots in the on-disk parameter cache
+        :param param_cache_dir: Parameter cache directory (default: param_cache.default_cache_dir())
+        :param leveled: If true, precompute the modulus chain (see at_level): ciphertexts can then be switched down to
+            smaller q bases (BFVSchemeServer.mod_switch_down) and every later operation works on fewer residues
         """
         # plaintext modulus
         self.t = int(t)
@@ -21,43 +32,148 @@ class BFVSchemeConfiguration:
         assert is_power_of_2(n), "n should be a power of 2"
         assert is_t_minus_1_multiple_of_2n(self.t,self.n), "t-1 must be a multiple of 2n" # helps with NTT
         # calculate an appropriate ct modulus (q), then get scaling factor (delta) and large mod (Q)
-        # also init RNS
+        # also init RNS. The search is deterministic, so its results are kept in the on-disk parameter cache
         max_residue_size = 2**32
         assert max_residue_size>=2**32, "max_residue_size must be at least 32 bit (to avoid implementation bugs)"
         self.residue_bits = int(math.ceil(math.log(max_residue_size,2)))
-        desired_q_numbits = int(desired_q_numbits)
-        approx_q_size = 2**desired_q_numbits
-        self.RNS_basis_q = gen_RNS_basis(lower_bound=approx_q_size, max_residue_size=max_residue_size, multiple_of=[self.t], scheme_SIMD_slots=self.n)
-        self.RNS_CRT_coeffs_q = compute_CRT_coefficients(self.RNS_basis_q)
+        self.desired_q_numbits = desired_q_numbits = int(desired_q_numbits)
+        cache_key = param_cache.make_key(self.t, desired_q_numbits, self.n, self.residue_bits)
+        params = param_cache.load_params(cache_key, param_cache_dir) if use_param_cache else None
+        self.loaded_from_param_cache = params is not None
+        if params is None:
+            params = self._derive_parameters(desired_q_numbits, max_residue_size)
+            if use_param_cache:
+                param_cache.store_params(cache_key, params, param_cache_dir)
+        register_psi(self.n, {int(p): psi for p, psi in params["psi"].items()})
+        self._set_bases(params["RNS_basis_q"], params["RNS_basis_qB"], params["RNS_basis_qBBa"], params["RNS_CRT_coeffs_q"], params["RNS_CRT_coeffs_qBBa"])
+        assert self.q >= 2**desired_q_numbits, "q is smaller than requested"
+        # eagerly precompute the base conversions used by ct ct multiplication
+        self._populate_conversion_cache()
+        # batch encode/decode is a negacyclic NTT mod t (slot i <-> evaluation at omega^(2i+1), natural order)
+        self._batch_ntt = NegacyclicNTT([self.t], self.n, psi=[params["batch_root"]])
+        self._batch_perm = np.array(bit_reverse_perm(self.n))
+        # encode/decode matrices are only built on demand (O(n^3) inversion), to cross-check the NTT encoder
+        self._E , self._WT = None, None
+        # secret key setting
+        self.ternary = bool(ternary)
+        # modulus chain, level_configs[l] is the configuration of level l (this one is the top level)
+        self.leveled = bool(leveled)
+        self.level = 0
+        self.level_configs = [self]
+        if self.leveled:
+            self._build_level_chain()
+
+    def _set_bases(self, RNS_basis_q, RNS_basis_qB, RNS_basis_qBBa, RNS_CRT_coeffs_q, RNS_CRT_coeffs_qBBa):
+        """q, qB and qBBa bases (python int lists) and everything derived from them"""
+        self.RNS_basis_q = np.array(RNS_basis_q, dtype=object)
+        self.RNS_basis_qB = np.array(RNS_basis_qB, dtype=object)
+        self.RNS_basis_qBBa = np.array(RNS_basis_qBBa, dtype=object)
+        self.RNS_CRT_coeffs_q = np.array(RNS_CRT_coeffs_q, dtype=object)
+        self.RNS_CRT_coeffs_qBBa = np.array(RNS_CRT_coeffs_qBBa, dtype=object)
         self.q = np.prod(self.RNS_basis_q)
         assert self.q % self.t==0, "q must be a multiple of t"
         self.Delta = self.q // self.t
         # (I think this is impossible actually!) assert self.Delta%2==0, "q must be an even multiple of t"
         self.Q = self.q * self.Delta
-        self.RNS_basis_qB = gen_RNS_basis(lower_bound=self.Q, max_residue_size=max_residue_size, multiple_of=self.RNS_basis_q, scheme_SIMD_slots=self.n)
-        # Ba is not massive like B/q. size must be at least 2*(l+gamma). I pick a very conservative factor (max_residue_size//2)
-        # - l is at most a few tens?? (number of primes in B basis)
-        # - gamma is usually at most a few tens?? (a noise/security factor in the BFV scheme, look at the paper if you want more info)
-        self.RNS_basis_qBBa = gen_RNS_basis(lower_bound=self.Q*max_residue_size//2, max_residue_size=max_residue_size, multiple_of=self.RNS_basis_qB, scheme_SIMD_slots=self.n)
+        assert np.prod(self.RNS_basis_qB) >= self.Q, "qB must be larger than Q"
         assert len(self.RNS_basis_qBBa)-len(self.RNS_basis_qB)==1, "Ba must fit inside a single residue"
         self.qBBa = np.prod(self.RNS_basis_qBBa)
         self.RNS_basis_B = np.array([int(b) for b in self.RNS_basis_qB if b not in self.RNS_basis_q], dtype=object)
         self.RNS_basis_Ba = np.array([int(b) for b in self.RNS_basis_qBBa if b not in self.RNS_basis_qB], dtype=object)
-        # get encode/decode matrices
-        self._E , self._WT = batch_encode_decode_matrices(n,t)
-        # secret key setting
-        self.ternary = bool(ternary)
+        # shared basis objects referenced by every RNSPolynomial
+        self.basis_q = RNSBasis(self.RNS_basis_q)
+        self.basis_qBBa = RNSBasis(self.RNS_basis_qBBa)
+        self.basis_B = RNSBasis(self.RNS_basis_B)
+        self.basis_Ba = RNSBasis(self.RNS_basis_Ba)
+        self.basis_BBa = RNSBasis(list(self.RNS_basis_B) + list(self.RNS_basis_Ba))
+        # Delta mod every q prime (scales an RNS encoded plaintext without bigints)
+        self.Delta_residues_q = self.basis_q.constant_residues(self.Delta)
+
+    def _build_level_chain(self):
+        """level l keeps the first l + 2 q primes (t and at least one more, so that Delta = q_l/t stays exact), the
+        top level is this configuration. Each level takes the shortest prefix of B with q_l*B_l >= Q_l = q_l*Delta_l
+        and the same Ba, so the BEHZ multiply keeps the headroom of the top level. All the primes are already NTT
+        friendly and registered, only the level bases, CRT coefficients and conversion constants are new
+        """
+        primes_q = [int(p) for p in self.RNS_basis_q]
+        primes_B, primes_Ba = [int(b) for b in self.RNS_basis_B], [int(b) for b in self.RNS_basis_Ba]
+        assert self.t in primes_q[:2], "t must stay in every level basis"
+        # every level keeps its multiply constants in the shared LRU, so the chain must not evict its own levels
+        conversion_cache.reserve(len(primes_q) * _CONVERSIONS_PER_LEVEL)
+        self.level_configs = []
+        for size in range(2, len(primes_q)):
+            q_l = primes_q[:size]
+            Delta_l = math.prod(q_l) // self.t
+            B_l = next(primes_B[:j] for j in range(1, len(primes_B) + 1) if math.prod(primes_B[:j]) >= Delta_l)
+            level = copy.copy(self)
+            level._set_bases(q_l, q_l + B_l, q_l + B_l + primes_Ba, compute_CRT_coefficients(q_l), compute_CRT_coefficients(q_l + B_l + primes_Ba))
+            level._populate_conversion_cache()
+            level.level = size - 2
+            self.level_configs.append(level)
+        self.level = len(primes_q) - 2
+        self.level_configs.append(self)
+        self._level_by_size = {len(cfg.basis_q): cfg for cfg in self.level_configs}
+        for cfg in self.level_configs:
+            cfg._level_by_size = self._level_by_size
+
+    @property
+    def max_level(self) -> int:
+        return len(self.level_configs) - 1
+
+    def at_level(self, level: int) -> "BFVSchemeConfiguration":
+        """configuration of level `level` of the modulus chain (shares t, n, the batch encoder and the NTT roots)"""
+        assert 0 <= level < len(self.level_configs), f"no level {level} in the modulus chain"
+        return self.level_configs[level]
+
+    def config_of(self, AorB) -> "BFVSchemeConfiguration":
+        """configuration of the chain level whose q basis AorB is in (this one if there is none, validation then fails)"""
+        if AorB.basis is self.basis_q or not self.leveled:
+            return self
+        cfg = self._level_by_size.get(len(AorB.basis))
+        return cfg if cfg is not None and AorB.basis == cfg.basis_q else self
+    
+    def _derive_parameters(self, desired_q_numbits: int, max_residue_size: int) -> dict:
+        """search the RNS bases, CRT coefficients and NTT roots (everything stored in the parameter cache)
+        returns a JSON friendly dict of python ints
+        """
+        approx_q_size = 2**desired_q_numbits
+        RNS_basis_q = gen_RNS_basis(lower_bound=approx_q_size, max_residue_size=max_residue_size, multiple_of=[self.t], scheme_SIMD_slots=self.n)
+        q = int(np.prod(RNS_basis_q))
+        Q = q * (q // self.t)
+        RNS_basis_qB = gen_RNS_basis(lower_bound=Q, max_residue_size=max_residue_size, multiple_of=RNS_basis_q, scheme_SIMD_slots=self.n)
+        # Ba is not massive like B/q. size must be at least 2*(l+gamma). I pick a very conservative factor (max_residue_size//2)
+        # - l is at most a few tens?? (number of primes in B basis)
+        # - gamma is usually at most a few tens?? (a noise/security factor in the BFV scheme, look at the paper if you want more info)
+        RNS_basis_qBBa = gen_RNS_basis(lower_bound=Q*max_residue_size//2, max_residue_size=max_residue_size, multiple_of=RNS_basis_qB, scheme_SIMD_slots=self.n)
+        return {
+            "RNS_basis_q": [int(p) for p in RNS_basis_q],
+            "RNS_basis_qB": [int(p) for p in RNS_basis_qB],
+            "RNS_basis_qBBa": [int(p) for p in RNS_basis_qBBa],
+            "RNS_CRT_coeffs_q": [int(c) for c in compute_CRT_coefficients(RNS_basis_q)],
+            "RNS_CRT_coeffs_qBBa": [int(c) for c in compute_CRT_coefficients(RNS_basis_qBBa)],
+            "batch_root": batch_encoding_root(self.n, self.t),
+            # every q/qB/qBBa residue is NTT friendly (json object keys must be strings)
+            "psi": {str(int(p)): known_psi(p, self.n) for p in RNS_basis_qBBa},
+        }
+
+    def _populate_conversion_cache(self):
+        """build the cached base conversion constants of the ct ct multiply pipeline (see conversion_cache.stats())"""
+        get_fastBconv(self.basis_q, self.basis_qBBa) # mod raise q -> qBBa
+        get_modswitch(self.basis_qBBa, self.basis_BBa) # modswitch qBBa -> BBa (drop q)
+        get_fastBconvEx(self.basis_BBa, self.basis_B, self.basis_Ba, self.basis_q) # exact conversion BBa -> q
+        get_scale_down(self.basis_qBBa, self.basis_q, self.basis_B, self.basis_Ba, self.t) # fused (t, modswitch, fastBconvEx)
+        get_scale_and_round(self.basis_q, self.t) # decryption t/q scale-and-round
     
     def is_AorB_valid(self, AorB) -> bool:
         """
-        Checks that A or B is a "n" long array of integers modulo q
+        Checks that A or B is a "n" long polynomial in RNS form modulo q
         """
         A = AorB
-        if not isinstance(A, np.ndarray):
-            raise TypeError("A and B must be numpy arrays")
-        if len(A) != self.n:
+        if not isinstance(A, RNSPolynomial):
+            raise TypeError("A and B must be RNSPolynomials")
+        if A.n != self.n:
             return False
-        if not all([isinstance(cmp,RNSInteger) and cmp.modulus==self.q for cmp in A]):
+        if A.basis != self.basis_q:
             return False
         return True
     
@@ -92,31 +208,128 @@ class BFVSchemeConfiguration:
                 res[i - n] -= cconv[i]
         return res
     
-    def polynomial_mult_nomod(self, a_in: np.ndarray, b_in: np.ndarray) -> np.ndarray:
-        return self._naive_polynomial_mult_nomod(a_in,b_in)
+    def get_ntt_engine(self, basis) -> NegacyclicNTT:
+        """returns the (cached) NTT engine for basis, or None if basis is not negacyclic NTT friendly"""
+        if not NegacyclicNTT.is_ntt_friendly(basis, self.n):
+            return None
+        return get_ntt_engine(basis, self.n)
+    
+    def _ntt_polynomial_mult_nomod(self, a_in: np.ndarray, b_in: np.ndarray) -> np.ndarray:
+        """Compute a*b mod x^n+1 with a per-residue negacyclic NTT
+        RNSInteger coefficients are multiplied residue by residue in their own basis.
+        Plain integer coefficients are multiplied exactly: they are mapped into the qBBa basis
+        (which is large enough for any product of two mod q polynomials), multiplied there, and
+        then CRT reconstructed to centred integers
+        """
+        n = len(a_in)
+        RNSin = bool(isinstance(a_in[0],RNSInteger))
+        if RNSin:
+            basis, modulus = a_in[0].basis, a_in[0].modulus
+            engine = self.get_ntt_engine(basis)
+            if engine is None:
+                return self._naive_polynomial_mult_nomod(a_in,b_in)
+            a = np.array([coef.residues for coef in a_in], dtype=np.uint64).T
+            b = np.array([coef.residues for coef in b_in], dtype=np.uint64).T
+            c = engine.multiply(a, b).astype(object)
+            res = np.empty(n, dtype=object)
+            for i in range(n):
+                res[i] = RNSInteger(0, basis, modulus)
+                res[i].residues = c[:, i]
+            return res
+        # exact integer product, fall back to naive if the result may not fit in qBBa
+        bound = 2 * n * max(abs(int(x)) for x in a_in) * max(abs(int(x)) for x in b_in)
+        if bound >= self.qBBa:
+            return self._naive_polynomial_mult_nomod(a_in,b_in)
+        engine = self.get_ntt_engine(self.RNS_basis_qBBa)
+        a = np.array([np.asarray(a_in, dtype=object) % p for p in engine.basis], dtype=np.uint64)
+        b = np.array([np.asarray(b_in, dtype=object) % p for p in engine.basis], dtype=np.uint64)
+        # CRT reconstruct, centre-lifted to (-qBBa/2 , qBBa/2]
+        return get_crt_reconstruction(engine.basis).reconstruct(engine.multiply(a, b), centered=True)
     
-    def encode_integers_with_RNS(self, ints_in: np.ndarray) -> np.ndarray:
-        """takes an np.ndarray of integers and returns an np.ndarray of RNSIntegers"""
-        rns_encoded_ints = [RNSInteger(x,self.RNS_basis_q) for x in ints_in.flatten()]
-        return np.array(rns_encoded_ints, dtype=object)
+    def polynomial_mult_nomod(self, a_in, b_in):
+        if isinstance(a_in, RNSPolynomial):
+            return a_in * b_in
+        return self._ntt_polynomial_mult_nomod(a_in,b_in)
     
-    def convert_RNS_backto_integers(self, RNS_in: np.ndarray) -> np.ndarray:
-        """takes an np.ndarray of RNSIntegers and returns an np.ndarray of ints"""
-        plain_ints = [int(x) for x in RNS_in.flatten()]
-        return np.array(plain_ints, dtype=object)
+    def encode_integers_with_RNS(self, ints_in: np.ndarray) -> RNSPolynomial:
+        """takes an np.ndarray of integers and returns an RNSPolynomial in the q basis"""
+        return RNSPolynomial.from_integers(ints_in, self.basis_q)
+    
+    def convert_RNS_backto_integers(self, RNS_in, centered: bool = False) -> np.ndarray:
+        """takes an RNSPolynomial (or np.ndarray of RNSIntegers sharing one basis) and returns an np.ndarray of ints
+        in [0, modulus), or in (-modulus/2, modulus/2] if centered
+        """
+        if isinstance(RNS_in, RNSPolynomial):
+            return RNS_in.to_integers(centered)
+        RNS_in = RNS_in.flatten()
+        residues = np.array([x.residues for x in RNS_in], dtype=object).T
+        return get_crt_reconstruction(RNS_in[0].basis).reconstruct(residues, centered)
+    
+    def _reduce_mod_t(self, x) -> np.ndarray:
+        x = np.asarray(x)
+        if x.dtype == object:
+            return np.array([int(xi) % self.t for xi in x.flat], dtype=np.uint64).reshape(x.shape)
+        return np.mod(x.astype(np.int64), self.t).astype(np.uint64)
     
     def batch_encode(self, v: np.ndarray) -> np.ndarray:
+        """slots -> plaintext polynomial coefficients (inverse negacyclic NTT mod t)
+        a (batch, n) array of slot vectors is encoded row by row in one transform
+        """
+        v = np.asarray(v)
+        assert v.shape[-1]==self.n, "integer vector bad length"
+        v = self._reduce_mod_t(v)
+        # slot i is evaluation number bitrev(i) of the NTT
+        m = self._batch_ntt.inverse(v[..., np.newaxis, self._batch_perm])[..., 0, :]
+        nooverflow_m = m.astype(object)
+        return nooverflow_m
+    
+    def batch_decode(self, m: np.ndarray) -> np.ndarray:
+        """plaintext polynomial coefficients -> slots (forward negacyclic NTT mod t), row by row for a (batch, n) array"""
+        m = np.asarray(m)
+        assert m.shape[-1]==self.n, "plaintext bad length"
+        m = self._reduce_mod_t(m)
+        v = self._batch_ntt.forward(m[..., np.newaxis, :])[..., 0, self._batch_perm]
+        return v.astype(object)
+    
+    # Galois automorphisms x -> x^g (odd g mod 2n) permute the slots: slot i holds m(omega^(2i+1)), which becomes
+    # m(omega^((2i+1)*g)). The powers of 3 and their negatives cover every odd exponent, so the slots form two
+    # rows of n/2 (exponents 3^j and -3^j) that x -> x^(3^k) rotates by k and x -> x^(2n-1) swaps
+    def galois_slot_permutation(self, g: int) -> np.ndarray:
+        """slot i of m(x^g) holds slot perm[i] of m"""
+        return (((2 * np.arange(self.n) + 1) * g) % (2 * self.n) - 1) // 2
+
+    def slot_rotation_rows(self) -> np.ndarray:
+        """(2, n/2) slot indices, row r column j is the slot of exponent (-1)^r * 3^j mod 2n
+        BFVSchemeServer.rotate(steps) maps v[rows] to np.roll(v[rows], -steps, axis=1), rotate_rows swaps the rows
+        """
+        exponents = np.array([pow(3, j, 2 * self.n) for j in range(self.n // 2)])
+        return np.stack(((exponents - 1) // 2, (2 * self.n - exponents - 1) // 2))
+
+    def galois_elements(self) -> list:
+        """rotations by powers of two 3^(2^j) mod 2n and the row swap 2n-1 (enough for every rotation and sum_slots)"""
+        return [pow(3, 2**j, 2 * self.n) for j in range(int(math.log2(self.n // 2)))] + [2 * self.n - 1]
+
+    def _get_batch_matrices(self) -> tuple[np.ndarray,np.ndarray]:
+        if self._E is None:
+            self._E , self._WT = batch_encode_decode_matrices(self.n,self.t)
+        return self._E , self._WT
+    
+    def _matrix_batch_encode(self, v: np.ndarray) -> np.ndarray:
+        """reference (dense Vandermonde inverse) batch encoding"""
         assert len(v)==self.n, "integer vector bad length"
+        E, _ = self._get_batch_matrices()
         vcol = v.reshape(self.n, 1)
-        m  = (self._E @ vcol) % self.t
+        m  = (E @ vcol) % self.t
         m = m.flatten()
         nooverflow_m = m.astype(object)
         return nooverflow_m
     
-    def batch_decode(self, m: np.ndarray) -> np.ndarray:
+    def _matrix_batch_decode(self, m: np.ndarray) -> np.ndarray:
+        """reference (dense Vandermonde) batch decoding"""
         assert len(m)==self.n, "plaintext bad length"
+        _, WT = self._get_batch_matrices()
         mcol = m.reshape(self.n, 1)
-        v = (self._WT @ mcol) % self.t
+        v = (WT @ mcol) % self.t
         return v.flatten()
     
     @staticmethod
@@ -132,7 +345,7 @@ class BFVSchemeConfiguration:
     def _vbasis_precalc_and_print(listin: list, target_basis, yname: str, zname: str=None):
         modulus = np.prod(listin)
         y_q  = [modulus // qi for qi in listin]
-        z_in_to_out = [sympy.mod_inverse(yi, qi) for yi, qi in zip(y_q, listin)]
+        z_in_to_out = [pow(int(yi % qi), -1, int(qi)) for yi, qi in zip(y_q, listin)]
         if zname is not None:
             print(f"parameter rns_residue_t {zname} = \'{{{BFVSchemeConfiguration._vfrnspa(z_in_to_out)}}};")
         y_mod_b = list()
@@ -1,65 +1,171 @@
 # BFV_model.py
 import numpy as np
 from BFV_config import BFVSchemeConfiguration
-from generic_math import gen_uniform_rand_arr, nparr_int_round, RNSInteger, polynomial_RNSmult_constant
+from generic_math import nparr_int_round
+from rns_polynomial import RNSPolynomial, SeededRNSPolynomial
+from ntt import get_ntt_engine
+from base_conversion import get_scale_down, get_scale_and_round
+from modular_kernels import mod_dot
 import math
 import copy
+import functools
+
+def _leveled(method):
+    """runs a client or server method as the instance of the modulus chain level of its first operand (the level
+    is told by the q basis of the operand, see BFVSchemeConfiguration.config_of)
+    """
+    @functools.wraps(method)
+    def run(self, A, *args, **kwargs):
+        return method(self._for_level_of(A), A, *args, **kwargs)
+    return run
+
 
 class BFVSchemeClient:
-    def __init__(self, config: BFVSchemeConfiguration):
+    def __init__(self, config: BFVSchemeConfiguration, seeded: bool = False):
         """
         :param config: the BFV scheme configuration containing all required parameters and settings
+        :param seeded: fresh ciphertexts and keys carry the XOF seed of their uniform half A (a SeededRNSPolynomial)
+            in place of A, serialization then writes the seed only and the receiver expands A when it is used
         """
         assert isinstance(config, BFVSchemeConfiguration)
         self.config = config
+        self.seeded = seeded
         # Secret key: polynomial degree n-1, n coefficients in {-1,0,1} or {0,1}
         if config.ternary:
             self._S = np.random.choice([-1, 0, 1], size=config.n).astype(object) % config.q # in practice you need to take this mod q
         else:
             self._S = np.random.choice([0, 1], size=config.n).astype(object)
+        # secret key per q residue, kept in NTT evaluation form (A*S is computed residue by residue)
+        self._S_rns = config.encode_integers_with_RNS(self._S).to_eval()
+        # S^2 per q residue (evaluation form), used by the relin keys and decrypt_deg2
+        self._S2_rns = self._S_rns * self._S_rns
         # relin keys
         self.relin_keys=self._compute_RLev_Ssqrd()
+        # clients of the levels of the modulus chain (see at_level), shared by all of them
+        self._levels = {config.level: self}
+
+    def at_level(self, level: int) -> "BFVSchemeClient":
+        """client of level `level` of the modulus chain (same secret key, restricted to the q primes of the level)"""
+        if level not in self._levels:
+            client = copy.copy(self)
+            client.config = self.config.at_level(level)
+            client._S_rns = self._S_rns.moddrop(client.config.basis_q)
+            client._S2_rns = self._S2_rns.moddrop(client.config.basis_q)
+            self._levels[level] = client
+        return self._levels[level]
+
+    def _for_level_of(self, A) -> "BFVSchemeClient":
+        config = self.config.config_of(A)
+        return self if config is self.config else self.at_level(config.level)
 
     def _compute_RLev_Ssqrd(self) -> list[tuple]:
         RLev_ciphertexts = []
-        S_sqrd = self.polynomial_mul(self._S, self._S)
-        for CRT_coef in self.config.RNS_CRT_coeffs_q:
-            # Gadget factor is related to the RNS modulus 
-            relinkey = CRT_coef*S_sqrd
+        S_sqrd = self._S2_rns.to_coeff()
+        for i in range(len(self.config.basis_q)):
+            # Gadget factor is related to the RNS modulus: CRT_coef_i*S^2 mod q
+            # CRT_coef_i is 1 mod q_i and 0 mod every other q prime, so only residue row i survives
+            rows = (np.arange(len(self.config.basis_q)) == i).reshape(-1, 1)
+            relinkey = RNSPolynomial(S_sqrd.residues * rows, self.config.basis_q)
             # encrypt the relinearization key
             A,B = self._alternative_RLWE_RNSencoded(relinkey)
             RLev_ciphertexts.append((A, B))
         return RLev_ciphertexts
 
+    def gen_galois_keys(self, galois_elements=None) -> dict:
+        """key switching keys from S(x^g) back to S for every Galois element g (default config.galois_elements())
+        Returns {g: [(A_i, B_i) per q prime]}, digit i encrypts CRT_coef_i*S(x^g) like the relin keys do for S^2
+        """
+        basis_q = self.config.basis_q
+        galois_elements = self.config.galois_elements() if galois_elements is None else galois_elements
+        keys = dict()
+        for g in galois_elements:
+            g = int(g) % (2 * self.config.n)
+            S_g = self._S_rns.automorphism(g).to_coeff()
+            # all the digits at once: a (k, k, n) stack, digit i keeps residue row i only
+            digits = RNSPolynomial(S_g.residues * np.eye(len(basis_q), dtype=np.uint64)[:, :, None], basis_q)
+            A, B = self._alternative_RLWE_RNSencoded(digits)
+            keys[g] = list(zip(A.unstack(), B.unstack()))
+        return keys
+
     def polynomial_mul(self, A, B):
         return self.config.polynomial_mult_nomod(A,B)
 
-    def _alternative_RLWE_RNSencoded(self, Xin: np.ndarray):
-        """Encrypts Xin (length n polynomial)
+    def _alternative_RLWE_RNSencoded(self, Xin: RNSPolynomial):
+        """Encrypts Xin (length n polynomial in RNS form mod q, or a stack of them)
         Returns tuple (A, B=-A*S+Xin+E)
         """
-        modulus = self.config.q
-        # random A (public key), n coefficients mod q, size n
-        A = gen_uniform_rand_arr(0, modulus, size=self.config.n)
-        # small noise E (centered discrete gaussian)
-        E = np.round(np.random.normal(0, 1, size=self.config.n)).astype(int)
+        # random A (public key), n coefficients uniform mod q, sampled directly in RNS form
+        if self.seeded:
+            A = SeededRNSPolynomial(np.random.bytes(32), self.config.basis_q, self.config.n, Xin.batch_shape)
+        else:
+            A = RNSPolynomial.uniform(self.config.basis_q, self.config.n, Xin.batch_shape)
+        # small noise E (centered discrete gaussian), int64 reduced by every q prime at once
+        E = np.round(np.random.normal(0, 1, size=Xin.batch_shape + (self.config.n,))).astype(np.int64)
         # B = -A*S + Xin + E, all mod q, S is persistent secret key
-        negAS = -self.polynomial_mul(A, self._S)
-        B = (negAS + Xin + E) % modulus
-        # return encryption result encoded with RNS
-        return self.config.encode_integers_with_RNS(A), self.config.encode_integers_with_RNS(B)
+        B = Xin + self.config.encode_integers_with_RNS(E) - (A * self._S_rns).to_coeff()
+        return A, B
     
     def encrypt(self, P: np.ndarray):
         """Encrypts plaintext P (integers mod t, length n).
         Returns ciphertext tuple (A, B)
         """
-        # Message encoding
+        # Message encoding, then Delta*M residue by residue
         M = self.config.batch_encode(np.array(P).flatten() % self.config.t)
-        DeltaM = (M * self.config.Delta) % self.config.q # length n
+        return self._encrypt_encoded(M)
+
+    def encrypt_batch(self, P: np.ndarray):
+        """Encrypts a (batch, n) array of plaintexts in one pass (one encode transform, one sampling,
+        one NTT product with the secret key for the whole stack)
+        Returns ciphertext tuple (A, B) of (batch, k, n) RNSPolynomials
+        """
+        P = np.asarray(P)
+        assert P.ndim == 2 and P.shape[1] == self.config.n, "expecting a (batch, n) array of plaintexts"
+        return self._encrypt_encoded(self.config.batch_encode(P))
+
+    def _encrypt_encoded(self, M: np.ndarray):
+        # Delta*M residue by residue
+        DeltaM = self.config.encode_integers_with_RNS(M.astype(np.int64)).mul_constant_residues(self.config.Delta_residues_q)
         # return encryption result
         return self._alternative_RLWE_RNSencoded(DeltaM)
 
+    @_leveled
     def decrypt(self, A, B):
+        """Decrypts ciphertext (A, B) residue by residue: x = B + A*S mod q per q prime, then
+        round(t/q * x) mod t with the {t, gamma} fast base conversion (see base_conversion.ScaleAndRound)
+        """
+        self.config.validate_AB(A,B)
+        x = (B + A * self._S_rns).to_coeff()
+        m = get_scale_and_round(self.config.basis_q, self.config.t).convert(x.residues)
+        return self.config.batch_decode(m)
+
+    def decrypt_batch(self, A, B):
+        """Decrypts a stack of ciphertexts ((batch, k, n) RNSPolynomials), returns a (batch, n) array of slots
+        A and B only need to broadcast to one batch, e.g. a single A with stacked B from add_cipherplain
+        """
+        assert len(np.broadcast_shapes(A.batch_shape, B.batch_shape)) == 1, "expecting (batch, k, n) ciphertexts"
+        return self.decrypt(A, B)
+
+    @_leveled
+    def noise_bits(self, A, B, P=None) -> float:
+        """log2 of the largest invariant noise coefficient |e|, where B + A*S = Delta*M + e mod q (centred)
+        M encodes the expected slots P if given (else the decrypted slots). Decryption is correct while |e| < Delta/2
+        """
+        self.config.validate_AB(A, B)
+        x = (B + A * self._S_rns).to_integers(centered=True)
+        M = self.config.batch_encode(self.decrypt(A, B) if P is None else np.asarray(P))
+        e = (x - self.config.Delta * M) % self.config.q
+        e = np.where(e > self.config.q // 2, e - self.config.q, e)
+        largest = max([abs(int(c)) for c in e.flatten()])
+        return math.log2(largest) if largest else 0.0
+
+    @_leveled
+    def noise_budget(self, A, B, P=None) -> float:
+        """bits of noise growth left before decryption fails: log2(Delta/2) - noise_bits"""
+        return math.log2(self.config.Delta // 2) - self.noise_bits(A, B, P)
+
+    @_leveled
+    def _bigint_decrypt(self, A, B):
+        """reference decryption: CRT reconstruct A and B, then bigint product, centre-lift and rounding"""
         self.config.validate_AB(A,B)
         A, B = self.config.convert_RNS_backto_integers(A), self.config.convert_RNS_backto_integers(B)
         inverseu  = (B + self.polynomial_mul(A, self._S)) % self.config.q
@@ -71,11 +177,21 @@ class BFVSchemeClient:
         decode_v = self.config.batch_decode(m)
         return decode_v
     
-    # WARNING: untested code!!!
-    # for example, try "pre_plain = client.decrypt_deg2(D0, D1, D2, modulus=modulus_bBa, scaling=config.Delta)"
-    #   -> after "modswitch" step in ct ct mul
-    def decrypt_deg2(self, D0, D1, D2, modulus, scaling):
-        """Decrypt a degree-2 ciphertext (D0,D1,D2) that is encrypted modulo `modulus` and
+    @_leveled
+    def decrypt_deg2(self, D0, D1, D2):
+        """Decrypts a degree-2 ciphertext (D0, D1, D2) mod q (see BFVSchemeServer.mul_ciphercipher_deg2), single or
+        stacked: x = D0 + D1*S + D2*S^2 per q prime, then the same scale-and-round as decrypt
+        """
+        self.config.validate_AB(D0, D1)
+        self.config.validate_AorB(D2)
+        x = (D0 + D1 * self._S_rns + D2 * self._S2_rns).to_coeff()
+        m = get_scale_and_round(self.config.basis_q, self.config.t).convert(x.residues)
+        return self.config.batch_decode(m)
+
+    # debugging aid for the intermediate ct ct multiplication steps, e.g.
+    # "pre_plain = client._bigint_decrypt_deg2(D0, D1, D2, modulus=modulus_bBa, scaling=config.Delta)" after "modswitch"
+    def _bigint_decrypt_deg2(self, D0, D1, D2, modulus, scaling):
+        """reference decryption of a degree-2 ciphertext (D0,D1,D2) that is encrypted modulo `modulus` and
             encodes the plaintext with factor  `scaling`
         scaling = Delta    -> after step (3)/(4)/(5)
                 = Delta^2  -> right after polynomial multiplication
@@ -101,13 +217,67 @@ class BFVSchemeClient:
 
 
 class BFVSchemeServer:
-    def __init__(self, config: BFVSchemeConfiguration):
+    def __init__(self, config: BFVSchemeConfiguration, executor=None):
+        """
+        Ciphertext halves (A, B) are RNSPolynomials tagged with their domain (coefficient or NTT evaluation form).
+        Additions and ct pt / ct ct tensor products run in whichever form the operands are in and products are
+        returned in evaluation form, transforms only happen when coefficient form is needed (base conversion, decrypt)
+        Every operation also takes stacked ciphertexts ((batch, k, n) halves, see BFVSchemeClient.encrypt_batch)
+        and (batch, n) plaintexts: the whole stack goes through each transform, conversion and relin key sweep at once
+        With a leveled config (see BFVSchemeConfiguration.at_level) every operation runs at the level of its
+        operands, which must share it (mod_switch_to moves a ciphertext down the chain)
+        :param executor: optional limb_executor.LimbExecutor, ct ct multiplication then splits its per-limb stages
+            (tensor product NTTs, relinearization multiply-accumulate) across its process pool
+        """
         self.config = config
+        self.executor = executor
+        # relinearization and Galois keys pre-transformed to evaluation form (see load_relin_keys)
+        # id(key list) -> (key list, evaluation form stack)
+        self._keys_eval = dict()
+        # servers of the levels of the modulus chain (see at_level), shared by all of them
+        self._levels = {config.level: self}
+
+    def at_level(self, level: int) -> "BFVSchemeServer":
+        """server of level `level` of the modulus chain (same executor, its own evaluation form key cache)"""
+        if level not in self._levels:
+            server = BFVSchemeServer(self.config.at_level(level), self.executor)
+            server._levels = self._levels
+            self._levels[level] = server
+        return self._levels[level]
+
+    def _for_level_of(self, A) -> "BFVSchemeServer":
+        config = self.config.config_of(A)
+        return self if config is self.config else self.at_level(config.level)
+
+    def load_relin_keys(self, RLev):
+        """Transform the RLev keys (or the key list of one Galois element) to evaluation form once,
+        stacked as one (2, num_digits, k, n) array (A keys, B keys)
+        Keys of a higher level (the client makes them at the top) keep the digits and residues of this level's
+        q primes: digit i encrypts CRT_coef_i*S^2, which is also the CRT coefficient of q_i in any q_l it divides
+        """
+        basis_q = self.config.basis_q
+        keys = RLev
+        if len(RLev) > len(basis_q):
+            keys = [(A.to_eval().moddrop(basis_q), B.to_eval().moddrop(basis_q)) for A, B in RLev[:len(basis_q)]]
+        for A, B in keys:
+            self.config.validate_AB(A, B)
+        RLevA_eval = np.stack([A.to_eval().residues for A, _ in keys])
+        RLevB_eval = np.stack([B.to_eval().residues for _, B in keys])
+        if len(self._keys_eval) >= 64:
+            self._keys_eval.clear()
+        self._keys_eval[id(RLev)] = (RLev, np.stack((RLevA_eval, RLevB_eval)))
+
+    def _get_relin_keys_eval(self, RLev):
+        entry = self._keys_eval.get(id(RLev))
+        if entry is None or entry[0] is not RLev:
+            self.load_relin_keys(RLev)
+        return self._keys_eval[id(RLev)][1]
 
     # helper function
     def polynomial_mul(self, A, B):
         return self.config.polynomial_mult_nomod(A,B)
 
+    @_leveled
     def add_ciphercipher(self, A1,B1,A2,B2):
         # error checking
         self.config.validate_AB(A1,B1)
@@ -117,35 +287,63 @@ class BFVSchemeServer:
         Bnew = B1+B2
         return Anew, Bnew
     
+    def _encode_plain(self, P):
+        """batch encode the slots P (or a (batch, n) stack) as an RNS polynomial mod q (not scaled by Delta)"""
+        return self.config.encode_integers_with_RNS(self.config.batch_encode(P))
+
+    @_leveled
     def add_cipherplain(self, A1, B1, P2):
         """P2 is interpreted as the raw integers you want to multiply, so it is encoded and converted to RNS"""
         self.config.validate_AB(A1,B1)
-        encoded_pt = self.config.encode_integers_with_RNS(self.config.batch_encode(P2))
-        Bnew = B1 + polynomial_RNSmult_constant(constant=self.config.Delta, polyRNScoeffs=encoded_pt)
+        encoded_pt = self._encode_plain(P2)
+        Bnew = B1 + encoded_pt.mul_constant_residues(self.config.Delta_residues_q)
         return A1, Bnew
     
+    @_leveled
     def mul_cipherplain(self, A1, B1, P2):
         """P2 is interpreted as the raw integers you want to multiply, so it is encoded and converted to RNS"""
         # error checking
         self.config.validate_AB(A1,B1)
         # mul
-        encoded_pt = self.config.encode_integers_with_RNS(self.config.batch_encode(P2))
+        encoded_pt = self._encode_plain(P2)
         Anew = self.polynomial_mul(A1, encoded_pt)
         Bnew = self.polynomial_mul(B1, encoded_pt)
         return Anew, Bnew
   
     def _decompMultRNS(self,D2,RLev):
-        # initialize total sums to 0
-        total_sumA = np.array([RNSInteger(0, self.config.RNS_basis_q) for _ in range(self.config.n)], dtype=object)
-        total_sumB = np.array([RNSInteger(0, self.config.RNS_basis_q) for _ in range(self.config.n)], dtype=object)
+        """Fused gadget decomposition, multiply and accumulate against the pre-transformed RLev keys
+        sum_i  D2_i * RLev_i  with D2_i the i-th residue row of D2 broadcast to all residues
+        (one forward NTT per digit, one inverse NTT per output polynomial)
+        """
+        basis_q = self.config.basis_q
+        RLev_eval = self._get_relin_keys_eval(RLev)
+        D2 = D2.to_coeff().residues
+        if self.executor is not None:
+            total_sumA, total_sumB = self.executor.decomp_mult(D2, RLev_eval, basis_q)
+            return RNSPolynomial(total_sumA, basis_q), RNSPolynomial(total_sumB, basis_q)
+        RLevA_eval, RLevB_eval = RLev_eval
+        engine = get_ntt_engine(basis_q.primes, self.config.n)
+        # (..., num_digits, k, n): digit i reduced mod every prime of the basis, then transformed
+        gadget_eval = engine.forward(D2[..., :, None, :] % basis_q.moduli)
+        # accumulate over the digits in evaluation form (one sweep over the keys for a whole stack)
+        total_sumA = mod_dot(gadget_eval, RLevA_eval, basis_q.moduli, axis=-3)
+        total_sumB = mod_dot(gadget_eval, RLevB_eval, basis_q.moduli, axis=-3)
+        return RNSPolynomial(engine.inverse(total_sumA), basis_q), RNSPolynomial(engine.inverse(total_sumB), basis_q)
+    
+    def _naive_decompMultRNS(self,D2,RLev):
+        """reference relinearization product (one gadget polynomial and two polynomial multiplies per digit)"""
+        basis_q = self.config.basis_q
+        D2 = D2.to_coeff()
+        # initialize total sums to 0 (accumulated in evaluation form, the partial products are pointwise)
+        total_sumA = RNSPolynomial.zeros(basis_q, self.config.n, RNSPolynomial.EVAL)
+        total_sumB = RNSPolynomial.zeros(basis_q, self.config.n, RNSPolynomial.EVAL)
         # construct decomp matrix (vector of polynomials) and perform mult with RLev keys
         for i, prime_modulo in enumerate(self.config.RNS_basis_q):
             # get the ith gadget decomp polynomial of D2 (polynomial of normal integers)
-            # Already in RNS basis, so extract the "i-th" residue from every coefficient in D2
-            gadget_polynomial_i = [coef.residues[i] for coef in D2]
-            # pretend like it is an RNSInteger (really need to broadcast each coefficient to all residues, easier to implement this way)
+            # Already in RNS basis, so extract the "i-th" residue row of D2
+            # and broadcast it to all residues (reduced mod every prime of the basis)
             # Note in hardware you dont actually need to write each coef in RNS basis (compute % prime_i). Just broadcast to all residues 
-            gadget_polynomial_i = [RNSInteger(coef,self.config.RNS_basis_q) for coef in gadget_polynomial_i]
+            gadget_polynomial_i = RNSPolynomial(D2.residues[i] % basis_q.moduli, basis_q)
             # get the relinearization keys
             corresponding_relinA_key = RLev[i][0]
             corresponding_relinB_key = RLev[i][1]
@@ -161,33 +359,138 @@ class BFVSchemeServer:
         ct_alpha = D1, D0
         ct_beta = self._decompMultRNS(D2,RLev)
         return self.add_ciphercipher(*ct_alpha, *ct_beta)
-    
-    def mul_ciphercipher(self, A1, B1, A2, B2, RLev):
-        # error checking
+
+    def _validate_deg2(self, D0, D1, D2):
+        self.config.validate_AB(D0, D1)
+        self.config.validate_AorB(D2)
+
+    # Degree-2 ciphertexts (D0, D1, D2) decrypt as D0 + D1*S + D2*S^2: products left unrelinearized, so a sum
+    # of products costs one relinearization (BFVSchemeClient.decrypt_deg2 decrypts them directly)
+    @_leveled
+    def mul_ciphercipher_deg2(self, A1, B1, A2, B2):
+        """ct ct product without relinearization, returns the degree-2 ciphertext (D0, D1, D2) mod q"""
         self.config.validate_AB(A1,B1)
         self.config.validate_AB(A2,B2)
-        # RNS Mod raise from q (current representation) to q*B*Ba (RNS_basis_qBBa)
-        A1 = np.array([coef.fastBconv(self.config.RNS_basis_qBBa) for coef in A1], dtype=object)
-        B1 = np.array([coef.fastBconv(self.config.RNS_basis_qBBa) for coef in B1], dtype=object)
-        A2 = np.array([coef.fastBconv(self.config.RNS_basis_qBBa) for coef in A2], dtype=object)
-        B2 = np.array([coef.fastBconv(self.config.RNS_basis_qBBa) for coef in B2], dtype=object)
-        # polynomial multiplication
-        D0 = self.polynomial_mul(B1,B2)
-        D1 = self.polynomial_mul(B2,A1) + self.polynomial_mul(B1,A2)
-        D2 = self.polynomial_mul(A1,A2)
-        # Constant Multiplication by t
-        D0 = np.array([coef.mul_constant(self.config.t) for coef in D0], dtype=object)
-        D1 = np.array([coef.mul_constant(self.config.t) for coef in D1], dtype=object)
-        D2 = np.array([coef.mul_constant(self.config.t) for coef in D2], dtype=object)
-        # modswitch from q*B*Ba (current representation) to B*Ba (RNS_BBa)
-        D0 = np.array([coef.modswitch(drop_modulis=self.config.RNS_basis_q) for coef in D0], dtype=object)
-        D1 = np.array([coef.modswitch(drop_modulis=self.config.RNS_basis_q) for coef in D1], dtype=object)
-        D2 = np.array([coef.modswitch(drop_modulis=self.config.RNS_basis_q) for coef in D2], dtype=object)
-        # fastBconvEx from B*Ba to q
-        D0 = np.array([coef.fastBconvEx(aux_modulis_B=self.config.RNS_basis_B, aux_modulis_Ba=self.config.RNS_basis_Ba, target_basis=self.config.RNS_basis_q) for coef in D0], dtype=object)
-        D1 = np.array([coef.fastBconvEx(aux_modulis_B=self.config.RNS_basis_B, aux_modulis_Ba=self.config.RNS_basis_Ba, target_basis=self.config.RNS_basis_q) for coef in D1], dtype=object)
-        D2 = np.array([coef.fastBconvEx(aux_modulis_B=self.config.RNS_basis_B, aux_modulis_Ba=self.config.RNS_basis_Ba, target_basis=self.config.RNS_basis_q) for coef in D2], dtype=object)
+        return self._tensor_product(*self._mod_raise(A1, B1), *self._mod_raise(A2, B2))
+
+    @_leveled
+    def add_deg2(self, D0, D1, D2, E0, E1, E2):
+        self._validate_deg2(D0, D1, D2)
+        self._validate_deg2(E0, E1, E2)
+        return D0+E0, D1+E1, D2+E2
+
+    @_leveled
+    def add_deg2_cipher(self, D0, D1, D2, A, B):
+        """degree-2 plus degree-1 ciphertext (A, B) = (D1, D0, 0)"""
+        self._validate_deg2(D0, D1, D2)
+        self.config.validate_AB(A, B)
+        return D0+B, D1+A, D2
+
+    @_leveled
+    def add_deg2_plain(self, D0, D1, D2, P):
+        self._validate_deg2(D0, D1, D2)
+        return D0 + self._encode_plain(P).mul_constant_residues(self.config.Delta_residues_q), D1, D2
+
+    @_leveled
+    def mul_deg2_plain(self, D0, D1, D2, P):
+        self._validate_deg2(D0, D1, D2)
+        encoded_pt = self._encode_plain(P)
+        return tuple(self.polynomial_mul(D, encoded_pt) for D in (D0, D1, D2))
+
+    @_leveled
+    def relinearize(self, D0, D1, D2, RLev):
+        """degree-2 ciphertext -> ciphertext (A, B) with the relinearization keys RLev"""
+        self._validate_deg2(D0, D1, D2)
+        return self._relinearization(D0, D1, D2, RLev)
+    
+    def _scale_down(self, D: np.ndarray) -> np.ndarray:
+        """multiply by t, drop q and convert B*Ba -> q for a stack of qBBa residue matrices"""
+        cfg = self.config
+        return get_scale_down(cfg.basis_qBBa, cfg.basis_q, cfg.basis_B, cfg.basis_Ba, cfg.t).convert(D)
+    
+    def _mod_raise(self, A, B):
+        """RNS Mod raise of a ciphertext from q (current representation) to q*B*Ba (RNS_basis_qBBa)"""
+        return A.fastBconv(self.config.basis_qBBa), B.fastBconv(self.config.basis_qBBa)
+
+    def _tensor_product(self, A1, B1, A2, B2):
+        """degree 2 product (D0, D1, D2) in q of two ciphertexts already raised to qBBa (see _mod_raise)"""
+        # polynomial multiplication, D stacks the coefficient residues (3, ..., k_qBBa, n)
+        if self.executor is not None:
+            D = self.executor.tensor_product(np.stack(np.broadcast_arrays(A1.residues, B1.residues, A2.residues, B2.residues)), self.config.basis_qBBa)
+        else:
+            D0 = self.polynomial_mul(B1,B2)
+            D1 = self.polynomial_mul(B2,A1) + self.polynomial_mul(B1,A2)
+            D2 = self.polynomial_mul(A1,A2)
+            D = np.stack(np.broadcast_arrays(D0.to_coeff().residues, D1.to_coeff().residues, D2.to_coeff().residues))
+        # Fused scale-down of all three polynomials at once (qBBa -> q):
+        # constant multiplication by t, modswitch from q*B*Ba to B*Ba (RNS_BBa), fastBconvEx from B*Ba to q
+        D0, D1, D2 = [RNSPolynomial(Di, self.config.basis_q) for Di in self._scale_down(D)]
+        return D0, D1, D2
+
+    @_leveled
+    def mul_ciphercipher(self, A1, B1, A2, B2, RLev):
+        # RNS Mod raise from q to q*B*Ba, tensor product and scale-down back to q (with error checking)
+        D0, D1, D2 = self.mul_ciphercipher_deg2(A1, B1, A2, B2)
         # Relinerization
         ctA, ctB = self._relinearization(D0, D1, D2, RLev)
         return ctA, ctB
 
+    @_leveled
+    def mod_switch_down(self, A, B):
+        """ciphertext (A, B) of level l -> level l - 1: x -> round(x / p) for the last q prime p of the level, the
+        exact single prime modswitch (RNSPolynomial.modswitch, see RNSInteger.modswitch) of x + (p - 1)/2
+        Delta_l = p * Delta_(l-1), so the plaintext is unchanged and the noise is divided by p (plus a rounding
+        term about the size of S)
+        """
+        self.config.validate_AB(A, B)
+        assert self.config.level > 0, "the ciphertext is at the lowest level of the modulus chain"
+        basis_q, lower = self.config.basis_q, self.config.at_level(self.config.level - 1).basis_q
+        half = RNSPolynomial(np.broadcast_to(basis_q.constant_residues(basis_q.primes[-1] // 2), (len(basis_q), self.config.n)), basis_q)
+        return (A.to_coeff() + half).modswitch(lower), (B.to_coeff() + half).modswitch(lower)
+
+    def mod_switch_to(self, A, B, level: int):
+        """switches (A, B) down the modulus chain to `level`, one mod_switch_down per dropped prime"""
+        current = self.config.config_of(A).level
+        assert level <= current, "ciphertexts only move down the modulus chain"
+        for _ in range(current - level):
+            A, B = self.mod_switch_down(A, B)
+        return A, B
+
+    @_leveled
+    def apply_galois(self, A, B, g: int, galois_keys: dict):
+        """ciphertext of m(x^g): automorphism of both halves, then key switching from S(x^g) back to S with the
+        same gadget decomposition and multiply-accumulate as relinearization (A(x^g) against the keys of g)
+        """
+        self.config.validate_AB(A, B)
+        g = int(g) % (2 * self.config.n)
+        assert g in galois_keys, f"no Galois key for element {g}"
+        sumA, sumB = self._decompMultRNS(A.automorphism(g), galois_keys[g])
+        return sumA, B.automorphism(g) + sumB
+
+    @_leveled
+    def rotate(self, A, B, steps: int, galois_keys: dict):
+        """rotates both slot rows (see config.slot_rotation_rows) left by steps, with the key of 3^steps if there is
+        one, else one key switch per set bit of steps mod n/2 (power of two rotations)
+        """
+        n2 = 2 * self.config.n
+        steps %= self.config.n // 2
+        if pow(3, steps, n2) in galois_keys:
+            return self.apply_galois(A, B, pow(3, steps, n2), galois_keys) if steps else (A, B)
+        for j in range(steps.bit_length()):
+            if (steps >> j) & 1:
+                A, B = self.apply_galois(A, B, pow(3, 2**j, n2), galois_keys)
+        return A, B
+
+    @_leveled
+    def rotate_rows(self, A, B, galois_keys: dict):
+        """swaps the two slot rows (automorphism x -> x^(2n-1))"""
+        return self.apply_galois(A, B, 2 * self.config.n - 1, galois_keys)
+
+    @_leveled
+    def sum_slots(self, A, B, galois_keys: dict):
+        """every slot <- sum of all n slots mod t, with log2(n) rotations: each row is folded onto itself with
+        rotations by 1, 2, ..., n/4, then the two rows are added
+        """
+        for j in range(int(math.log2(self.config.n // 2))):
+            A, B = self.add_ciphercipher(A, B, *self.rotate(A, B, 2**j, galois_keys))
+        return self.add_ciphercipher(A, B, *self.rotate_rows(A, B, galois_keys))
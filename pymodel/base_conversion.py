@@ -0,0 +1,250 @@
+# base_conversion.py
+"""
+Precomputed constants for the RNS base conversions (fastBconv, modswitch, fastBconvEx)
+Every precomputation depends only on the (source basis, target basis) pair, so it is built once and
+kept in a bounded LRU cache (conversion_cache) shared by RNSInteger and RNSPolynomial.
+Bases are passed as any iterable of primes (np.ndarray, tuple, RNSBasis, ...)
+"""
+import numpy as np
+from collections import OrderedDict
+from modular_kernels import mod_mul, mod_sub, mod_matmul
+
+def _primes(basis) -> tuple:
+    return tuple(int(p) for p in basis)
+
+def _column(values) -> np.ndarray:
+    return np.array(values, dtype=np.uint64).reshape(-1, 1)
+
+def _product(primes) -> int:
+    prod = 1
+    for p in primes:
+        prod *= p
+    return prod
+
+class FastBaseConverter:
+    def __init__(self, source_basis, target_basis):
+        """Precomputed constants of the fast base conversion source_basis -> target_basis"""
+        self.source_primes = _primes(source_basis)
+        self.target_primes = _primes(target_basis)
+        self.source_moduli = _column(self.source_primes)
+        self.target_moduli = _column(self.target_primes)
+        q = _product(self.source_primes)
+        y = [q // qi for qi in self.source_primes] # yi = q/qi
+        # zi = yi^{-1} mod qi, one per input residue
+        self.z_list = [pow(yi % qi, -1, qi) for yi, qi in zip(y, self.source_primes)]
+        # (k_out x k_in) table, row j holds yi mod bj
+        self.y_mod_b_list = [[yi % bj for yi in y] for bj in self.target_primes]
+        self.z = _column(self.z_list)
+        self.y_mod_b = np.array(self.y_mod_b_list, dtype=np.uint64)
+
+    def convert(self, residues: np.ndarray) -> np.ndarray:
+        """fast base conversion of a (..., k_in, n) residue matrix, returns the (..., k_out, n) residue matrix
+        result = sum_i |xi * zi|_qi * yi  mod bj  (may be off by a small multiple of q, like fastBconv)
+        """
+        a = mod_mul(residues, self.z, self.source_moduli) # ai
+        return mod_matmul(self.y_mod_b, a, self.target_moduli)
+
+class ModSwitch:
+    def __init__(self, source_basis, target_basis):
+        """Precomputed constants of the modswitch from source_basis (d and f) to the subset target_basis (f)"""
+        self.source_primes = _primes(source_basis)
+        self.target_primes = _primes(target_basis)
+        keep = set(self.target_primes)
+        assert keep.issubset(self.source_primes), "target basis must be a subset of the source basis"
+        self.keep_idx = [i for i, m in enumerate(self.source_primes) if m in keep]
+        self.drop_idx = [i for i, m in enumerate(self.source_primes) if m not in keep]
+        self.drop_primes = tuple(self.source_primes[i] for i in self.drop_idx)
+        d = _product(self.drop_primes)
+        self.finv_list = [pow(d % fi, -1, fi) for fi in self.target_primes]
+        self.finv = _column(self.finv_list)
+        self.target_moduli = _column(self.target_primes)
+        # fast base convert the "to-be-dropped" part onto the f basis
+        self.drop_to_keep = get_fastBconv(self.drop_primes, self.target_primes)
+
+    def convert(self, residues: np.ndarray) -> np.ndarray:
+        """modswitch of a (..., k_source, n) residue matrix, returns the (..., k_target, n) residue matrix"""
+        xhat_f = self.drop_to_keep.convert(residues[..., self.drop_idx, :])
+        delta = mod_sub(residues[..., self.keep_idx, :], xhat_f, self.target_moduli)
+        return mod_mul(delta, self.finv, self.target_moduli)
+
+class FastBconvEx:
+    def __init__(self, source_basis, aux_basis_B, aux_basis_Ba, target_basis):
+        """Precomputed constants of the exact fast base conversion from source_basis (= B union Ba) to target_basis"""
+        self.source_primes = _primes(source_basis)
+        self.B_primes = _primes(aux_basis_B)
+        self.Ba_primes = _primes(aux_basis_Ba)
+        self.target_primes = _primes(target_basis)
+        assert set(self.B_primes).isdisjoint(set(self.Ba_primes)), "aux_modulis_B and aux_modulis_Ba must be disjoint"
+        assert len(self.Ba_primes)==1, "Ba must fit inside 1 residue"
+        self.B_idx = [i for i, m in enumerate(self.source_primes) if m in self.B_primes]
+        self.Ba_idx = [i for i, m in enumerate(self.source_primes) if m in self.Ba_primes]
+        b_bigmodulus = _product(self.B_primes)
+        self.Ba = self.Ba_primes[0]
+        self.b_inv_Ba = pow(b_bigmodulus % self.Ba, -1, self.Ba)
+        self.b_mod_q_list = [b_bigmodulus % p for p in self.target_primes]
+        self.b_mod_q = _column(self.b_mod_q_list)
+        self.target_moduli = _column(self.target_primes)
+        self.B_to_Ba = get_fastBconv(self.B_primes, self.Ba_primes)
+        self.B_to_q = get_fastBconv(self.B_primes, self.target_primes)
+
+    def convert(self, residues: np.ndarray) -> np.ndarray:
+        """exact conversion of a (..., k_source, n) residue matrix, returns the (..., k_target, n) residue matrix"""
+        xB = residues[..., self.B_idx, :]
+        xBa = residues[..., self.Ba_idx, :]
+        Ba = np.uint64(self.Ba)
+        # gamma in Ba basis, centred to a small signed integer
+        temp = mod_sub(self.B_to_Ba.convert(xB), xBa, Ba)
+        gamma = mod_mul(temp, np.uint64(self.b_inv_Ba), Ba).astype(np.int64)
+        gamma = np.where(gamma > self.Ba // 2, gamma - self.Ba, gamma)
+        # final exact conversion: xB_to_q - gamma * b  mod q
+        gamma_q = np.mod(gamma, self.target_moduli.astype(np.int64)).astype(np.uint64)
+        return mod_sub(self.B_to_q.convert(xB), mod_mul(gamma_q, self.b_mod_q, self.target_moduli), self.target_moduli)
+
+class ScaleDown:
+    def __init__(self, source_basis, q_basis, aux_basis_B, aux_basis_Ba, t: int):
+        """Fused ct ct multiply scale-down: multiply by t, modswitch source_basis (q B Ba) -> B Ba (drop q),
+        then exact conversion B Ba -> q. The factor t is folded into the modswitch constants
+        (t*x_d is fast base converted by using t*zi in place of zi)
+        """
+        self.t = int(t)
+        self.source_primes = _primes(source_basis)
+        self.q_primes = _primes(q_basis)
+        BBa_primes = tuple(m for m in self.source_primes if m not in self.q_primes)
+        self.modswitch = get_modswitch(self.source_primes, BBa_primes)
+        self.exact = get_fastBconvEx(BBa_primes, aux_basis_B, aux_basis_Ba, self.q_primes)
+        drop = self.modswitch.drop_to_keep
+        self.tz = _column([(self.t * zi) % qi for zi, qi in zip(drop.z_list, drop.source_primes)])
+        self.t_mod_f = _column([self.t % fi for fi in self.modswitch.target_primes])
+
+    def convert(self, residues: np.ndarray) -> np.ndarray:
+        """scale down a (..., k_qBBa, n) residue matrix (e.g. the stacked D0, D1, D2) to a (..., k_q, n) matrix"""
+        ms, drop = self.modswitch, self.modswitch.drop_to_keep
+        f_moduli = ms.target_moduli
+        # modswitch of t*x: (t*x_f - fastBconv(t*x_d)) * d^{-1}  mod f
+        a = mod_mul(residues[..., ms.drop_idx, :], self.tz, drop.source_moduli)
+        xhat_f = mod_matmul(drop.y_mod_b, a, f_moduli)
+        delta = mod_sub(mod_mul(residues[..., ms.keep_idx, :], self.t_mod_f, f_moduli), xhat_f, f_moduli)
+        # exact conversion B Ba -> q
+        return self.exact.convert(mod_mul(delta, ms.finv, f_moduli))
+
+class ScaleAndRound:
+    def __init__(self, q_basis, t: int, gamma: int = 2**31 - 1):
+        """BFV decryption scale-and-round  m = round(t/q * x) mod t  of x mod q, computed in RNS
+        t must be one of the q primes, so t/q = 1/d with d the product of the other q primes (D basis).
+        For m' in {t, gamma}: s = (gamma*x - fastBconv(|gamma*x|_d, D -> m')) * d^{-1}  mod m'
+        As integers s = gamma*round(x/d) + eps, with eps = floor(gamma*e/d) - u small (e the noise,
+        u < |D| the fastBconv overflow), and gamma*x = 0 mod gamma, so eps is the centred s mod gamma
+        and  round(x/d) = (s_t - eps) * gamma^{-1}  mod t.  Correct while |e|/d < 1/2 - |D|/gamma
+        """
+        self.q_primes = _primes(q_basis)
+        self.t = int(t)
+        self.gamma = int(gamma)
+        assert self.t in self.q_primes, "t must be one of the q basis primes"
+        assert self.gamma not in self.q_primes and self.gamma < 2**32, "gamma must be a 32 bit prime outside the q basis"
+        self.t_idx = self.q_primes.index(self.t)
+        self.d_idx = [i for i in range(len(self.q_primes)) if i != self.t_idx]
+        self.d_primes = tuple(self.q_primes[i] for i in self.d_idx)
+        assert len(self.d_primes) < self.gamma // 4, "gamma too small for the fastBconv overflow"
+        d = _product(self.d_primes)
+        self.d_to_tg = get_fastBconv(self.d_primes, (self.t, self.gamma))
+        self.gamma_mod_d = _column([self.gamma % p for p in self.d_primes])
+        self.d_moduli = _column(self.d_primes)
+        self.gamma_mod_t = np.uint64(self.gamma % self.t)
+        self.dinv_t = np.uint64(pow(d % self.t, -1, self.t))
+        self.neg_dinv_gamma = np.uint64((-pow(d % self.gamma, -1, self.gamma)) % self.gamma)
+        self.gamma_inv_t = np.uint64(pow(self.gamma, -1, self.t))
+
+    def convert(self, residues: np.ndarray) -> np.ndarray:
+        """scale-and-round a (..., k_q, n) residue matrix, returns the (..., n) plaintext coefficients mod t"""
+        t, gamma = np.uint64(self.t), np.uint64(self.gamma)
+        y = mod_mul(residues[..., self.d_idx, :], self.gamma_mod_d, self.d_moduli) # |gamma*x|_d
+        conv = self.d_to_tg.convert(y)
+        xt = residues[..., self.t_idx, :]
+        s_t = mod_mul(mod_sub(mod_mul(xt, self.gamma_mod_t, t), conv[..., 0, :], t), self.dinv_t, t)
+        s_gamma = mod_mul(conv[..., 1, :], self.neg_dinv_gamma, gamma).astype(np.int64)
+        eps = np.where(s_gamma > self.gamma // 2, s_gamma - self.gamma, s_gamma) # centred
+        eps_t = np.mod(eps, self.t).astype(np.uint64)
+        return mod_mul(mod_sub(s_t, eps_t, t), self.gamma_inv_t, t)
+
+class CRTReconstruction:
+    def __init__(self, basis):
+        """Precomputed CRT coefficients alpha_i = (q/qi) * |(q/qi)^{-1}|_qi of basis (like compute_CRT_coefficients)"""
+        self.primes = _primes(basis)
+        self.modulus = _product(self.primes)
+        self.alpha = np.array([(self.modulus // qi) * pow((self.modulus // qi) % qi, -1, qi) for qi in self.primes], dtype=object)
+
+    def reconstruct(self, residues: np.ndarray, centered: bool = False) -> np.ndarray:
+        """CRT reconstruction of a (..., k, n) residue matrix in one pass: sum_i alpha_i * xi  mod q
+        returns the (..., n) object array of integers in [0, q), or in (-q/2, q/2] if centered
+        """
+        x = np.tensordot(self.alpha, np.asarray(residues).astype(object), axes=([0], [-2])) % self.modulus
+        if centered:
+            x = np.where(x > self.modulus // 2, x - self.modulus, x)
+        return x
+
+
+class BasisPairCache:
+    def __init__(self, maxsize: int = 128):
+        """Bounded LRU cache of base conversion precomputations keyed by (kind, source basis, target basis)
+        hits/misses count every lookup so callers can check that a hot path never recomputes
+        """
+        self.maxsize = int(maxsize)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, builder):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        value = builder()
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False) # evict least recently used
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def reserve(self, entries: int):
+        """grow maxsize so that `entries` new entries fit next to the current ones without evicting any of them"""
+        self.maxsize = max(self.maxsize, len(self._entries) + int(entries))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "maxsize": self.maxsize}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._entries.clear()
+        self.reset_stats()
+
+conversion_cache = BasisPairCache()
+
+def get_fastBconv(source_basis, target_basis) -> FastBaseConverter:
+    source, target = _primes(source_basis), _primes(target_basis)
+    return conversion_cache.get(("fastBconv", source, target), lambda: FastBaseConverter(source, target))
+
+def get_modswitch(source_basis, target_basis) -> ModSwitch:
+    source, target = _primes(source_basis), _primes(target_basis)
+    return conversion_cache.get(("modswitch", source, target), lambda: ModSwitch(source, target))
+
+def get_fastBconvEx(source_basis, aux_basis_B, aux_basis_Ba, target_basis) -> FastBconvEx:
+    source, B, Ba, target = _primes(source_basis), _primes(aux_basis_B), _primes(aux_basis_Ba), _primes(target_basis)
+    return conversion_cache.get(("fastBconvEx", source, target, B, Ba), lambda: FastBconvEx(source, B, Ba, target))
+
+def get_crt_reconstruction(basis) -> CRTReconstruction:
+    primes = _primes(basis)
+    return conversion_cache.get(("crt", primes), lambda: CRTReconstruction(primes))
+
+def get_scale_and_round(q_basis, t: int, gamma: int = 2**31 - 1) -> ScaleAndRound:
+    q = _primes(q_basis)
+    return conversion_cache.get(("scale_and_round", q, int(t), int(gamma)), lambda: ScaleAndRound(q, t, gamma))
+
+def get_scale_down(source_basis, q_basis, aux_basis_B, aux_basis_Ba, t: int) -> ScaleDown:
+    source, q, B, Ba = _primes(source_basis), _primes(q_basis), _primes(aux_basis_B), _primes(aux_basis_Ba)
+    return conversion_cache.get(("scale_down", source, q, B, Ba, int(t)), lambda: ScaleDown(source, q, B, Ba, t))
@@ -0,0 +1,390 @@
+import numpy as np
+import random
+import argparse
+import time
+import tempfile
+import os
+import pickle
+
+from BFV_config import BFVSchemeConfiguration
+from BFV_model import BFVSchemeClient, BFVSchemeServer
+from rns_polynomial import RNSPolynomial
+from base_conversion import conversion_cache, get_scale_down
+from ntt_friendly_prime import clear_prime_pools
+from generic_math import gen_uniform_rand_arr
+from limb_executor import LimbExecutor
+from circuit import Circuit
+import serialization
+from streaming import encrypt_stream, decrypt_stream, StreamStats
+from noise_planner import plan_parameters
+
+random.seed(123)
+np.random.seed(123)
+
+def timeit(func, reps: int = 1) -> float:
+    """returns the best wall clock time (seconds) of reps calls of func"""
+    best = float("inf")
+    for _ in range(reps):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def report(name: str, reference_s: float, new_s: float):
+    print(f"{name:<40} reference {reference_s*1e3:10.2f} ms   new {new_s*1e3:10.2f} ms   speedup {reference_s/new_s:8.1f}x")
+
+def random_polynomial(basis, n: int) -> RNSPolynomial:
+    return RNSPolynomial(np.array([np.random.randint(0, p, size=n, dtype=np.uint64) for p in basis.primes]), basis)
+
+def bench_fastBconv(config: BFVSchemeConfiguration):
+    """mod raise q -> qBBa: per-coefficient RNSInteger.fastBconv vs whole-polynomial matrix form"""
+    poly = random_polynomial(config.basis_q, config.n)
+    coeffs = poly.to_RNSIntegers()
+    reference = lambda: [coef.fastBconv(config.RNS_basis_qBBa) for coef in coeffs]
+    new = lambda: poly.fastBconv(config.basis_qBBa)
+    assert np.array_equal(RNSPolynomial.from_RNSIntegers(reference(), config.basis_qBBa).residues, new().residues), "fastBconv mismatch"
+    report("fastBconv q -> qBBa", timeit(reference), timeit(new, 5))
+
+def bench_conversion_cache(config: BFVSchemeConfiguration):
+    """ct ct multiply must find every base conversion constant in the cache populated by the configuration"""
+    client, server = BFVSchemeClient(config), BFVSchemeServer(config)
+    A1, B1 = client.encrypt(np.random.randint(0, config.t, size=config.n))
+    A2, B2 = client.encrypt(np.random.randint(0, config.t, size=config.n))
+    conversion_cache.reset_stats()
+    server.mul_ciphercipher(A1, B1, A2, B2, client.relin_keys)
+    stats = conversion_cache.stats()
+    print(f"{'conversion cache during mul_ciphercipher':<40} {stats}")
+    assert stats["misses"] == 0, "mul_ciphercipher recomputed base conversion constants"
+    # a long modulus chain must keep the constants of every level, down to the lowest one
+    leveled = BFVSchemeConfiguration(config.t, 600, config.n, config.ternary, leveled=True)
+    client, server = BFVSchemeClient(leveled), BFVSchemeServer(leveled)
+    A, B = server.mod_switch_to(*client.encrypt(np.random.randint(0, config.t, size=config.n)), 0)
+    conversion_cache.reset_stats()
+    server.mul_ciphercipher(A, B, A, B, client.relin_keys)
+    stats = conversion_cache.stats()
+    print(f"{f'... at level 0 of {leveled.max_level}':<40} {stats}")
+    assert stats["misses"] == 0, "the modulus chain evicted the base conversion constants of its lowest level"
+
+def bench_scale_down(config: BFVSchemeConfiguration):
+    """ct ct multiply scale-down of D0, D1, D2: per-coefficient (t, modswitch, fastBconvEx) vs fused matrix form"""
+    D = [random_polynomial(config.basis_qBBa, config.n) for _ in range(3)]
+    def reference():
+        out = []
+        for Di in D:
+            coeffs = [coef.mul_constant(config.t) for coef in Di.to_RNSIntegers()]
+            coeffs = [coef.modswitch(drop_modulis=config.RNS_basis_q) for coef in coeffs]
+            coeffs = [coef.fastBconvEx(aux_modulis_B=config.RNS_basis_B, aux_modulis_Ba=config.RNS_basis_Ba, target_basis=config.RNS_basis_q) for coef in coeffs]
+            out.append(RNSPolynomial.from_RNSIntegers(coeffs, config.basis_q).residues)
+        return np.stack(out)
+    scale_down = get_scale_down(config.basis_qBBa, config.basis_q, config.basis_B, config.basis_Ba, config.t)
+    stacked = np.stack([Di.residues for Di in D])
+    new = lambda: scale_down.convert(stacked)
+    unfused = np.stack([Di.mul_constant(config.t).modswitch(config.basis_BBa).fastBconvEx(config.basis_B, config.basis_Ba, config.basis_q).residues for Di in D])
+    assert np.array_equal(reference(), new()) and np.array_equal(unfused, new()), "scale-down mismatch"
+    report("scale-down D0,D1,D2 qBBa -> q", timeit(reference), timeit(new, 5))
+
+def bench_relinearization(config: BFVSchemeConfiguration):
+    """relinearization product: per-digit polynomial multiplies vs fused multiply-accumulate on pre-transformed keys"""
+    client, server = BFVSchemeClient(config), BFVSchemeServer(config)
+    server.load_relin_keys(client.relin_keys)
+    D2 = random_polynomial(config.basis_q, config.n)
+    reference = lambda: [P.to_coeff() for P in server._naive_decompMultRNS(D2, client.relin_keys)]
+    new = lambda: server._decompMultRNS(D2, client.relin_keys)
+    assert all([np.array_equal(r.residues, m.residues) for r, m in zip(reference(), new())]), "relinearization mismatch"
+    report("relinearization (decompose, mult, acc)", timeit(reference, 3), timeit(new, 3))
+
+def bench_batch_encode(config: BFVSchemeConfiguration):
+    """batch encode + decode: dense Vandermonde matrices (including the one-off inversion) vs NTT mod t"""
+    v = np.random.randint(0, config.t, size=config.n)
+    build = timeit(config._get_batch_matrices)
+    reference = lambda: config._matrix_batch_decode(config._matrix_batch_encode(v))
+    new = lambda: config.batch_decode(config.batch_encode(v))
+    assert [int(x) for x in config._matrix_batch_encode(v)] == [int(x) for x in config.batch_encode(v)], "batch_encode mismatch"
+    assert [int(x) for x in reference()] == [int(x) for x in new()] == [int(x) for x in v], "batch_decode mismatch"
+    print(f"{'encode/decode matrix construction':<40} {build*1e3:10.2f} ms (no longer done by the configuration)")
+    report("batch encode + decode", timeit(reference, 3), timeit(new, 3))
+
+def bench_param_cache(config: BFVSchemeConfiguration):
+    """configuration construction: full parameter search vs load from the on-disk parameter cache"""
+    args = (config.t, config.desired_q_numbits, config.n, config.ternary)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        BFVSchemeConfiguration(*args, param_cache_dir=cache_dir) # populate
+        warm = BFVSchemeConfiguration(*args, param_cache_dir=cache_dir)
+        cold = BFVSchemeConfiguration(*args, use_param_cache=False)
+        assert warm.loaded_from_param_cache and not cold.loaded_from_param_cache, "parameter cache was not used"
+        assert list(warm.RNS_basis_qBBa) == list(cold.RNS_basis_qBBa), "cached bases differ from the searched ones"
+        def cold():
+            clear_prime_pools() # no prime search results left over from earlier constructions
+            BFVSchemeConfiguration(*args, use_param_cache=False)
+        report("BFVSchemeConfiguration construction", timeit(cold), timeit(lambda: BFVSchemeConfiguration(*args, param_cache_dir=cache_dir), 3))
+
+def bench_uniform_sampling(config: BFVSchemeConfiguration):
+    """public polynomial A: bigint randrange mod q + RNS encoding vs per-prime sampling of the residue matrix"""
+    reference = lambda: config.encode_integers_with_RNS(gen_uniform_rand_arr(0, config.q, config.n))
+    new = lambda: RNSPolynomial.uniform(config.basis_q, config.n)
+    report("uniform A mod q", timeit(reference, 3), timeit(new, 5))
+
+def bench_encrypt(config: BFVSchemeConfiguration):
+    """client encryption: bigint pipeline (Delta*M mod q, A*S on 300+ bit integers) vs residue by residue"""
+    client = BFVSchemeClient(config)
+    P = np.random.randint(0, config.t, size=config.n)
+    def reference():
+        DeltaM = (config.batch_encode(P) * config.Delta) % config.q
+        A = gen_uniform_rand_arr(0, config.q, config.n)
+        E = np.round(np.random.normal(0, 1, size=config.n)).astype(int)
+        B = (-client.polynomial_mul(A, client._S) + DeltaM + E) % config.q
+        return config.encode_integers_with_RNS(A), config.encode_integers_with_RNS(B)
+    assert [int(x) for x in client.decrypt(*reference())] == [int(x) for x in P], "bigint encryption mismatch"
+    assert [int(x) for x in client.decrypt(*client.encrypt(P))] == [int(x) for x in P], "RNS encryption mismatch"
+    report("encrypt", timeit(reference, 3), timeit(lambda: client.encrypt(P), 5))
+
+def bench_decrypt(config: BFVSchemeConfiguration):
+    """client decryption: CRT reconstruction + bigint rounding vs RNS scale-and-round with the {t, gamma} base conversion"""
+    client = BFVSchemeClient(config)
+    P = np.random.randint(0, config.t, size=config.n)
+    A, B = client.encrypt(P)
+    assert [int(x) for x in client._bigint_decrypt(A, B)] == [int(x) for x in client.decrypt(A, B)] == [int(x) for x in P], "decrypt mismatch"
+    report("decrypt", timeit(lambda: client._bigint_decrypt(A, B), 3), timeit(lambda: client.decrypt(A, B), 5))
+
+def bench_crt(config: BFVSchemeConfiguration):
+    """whole polynomial CRT reconstruction: per-coefficient int(RNSInteger) vs one pass over the residue matrix"""
+    poly = random_polynomial(config.basis_q, config.n)
+    coeffs = poly.to_RNSIntegers()
+    reference = lambda: np.array([int(coef) for coef in coeffs], dtype=object)
+    new = lambda: poly.to_integers()
+    assert list(reference()) == list(new()), "CRT reconstruction mismatch"
+    centered = poly.to_integers(centered=True)
+    assert all([(c - x) % config.q == 0 and -config.q // 2 < c <= config.q // 2 for c, x in zip(centered, new())]), "centered CRT mismatch"
+    report("CRT reconstruction q -> integers", timeit(reference, 3), timeit(new, 5))
+
+def bench_batch_api(config: BFVSchemeConfiguration, batch: int = 32):
+    """encrypt, ct ct multiply and decrypt of a batch of plaintexts: one call per ciphertext vs stacked ciphertexts"""
+    client, server = BFVSchemeClient(config), BFVSchemeServer(config)
+    P1, P2 = [np.random.randint(0, config.t, size=(batch, config.n)) for _ in range(2)]
+    def reference():
+        return np.array([client.decrypt(*server.mul_ciphercipher(*client.encrypt(p1), *client.encrypt(p2), client.relin_keys)) for p1, p2 in zip(P1, P2)])
+    def new():
+        return client.decrypt_batch(*server.mul_ciphercipher(*client.encrypt_batch(P1), *client.encrypt_batch(P2), client.relin_keys))
+    expected = (P1 * P2) % config.t
+    assert np.array_equal(reference().astype(int), expected) and np.array_equal(new().astype(int), expected), "batched evaluation mismatch"
+    report(f"encrypt, mul, decrypt x{batch}", timeit(reference, 3), timeit(new, 3))
+
+def bench_limb_executor(config: BFVSchemeConfiguration, workers: int = None):
+    """ct ct multiply: serial per-limb stages vs limb groups on a process pool (needs several cores to pay off)"""
+    workers = workers or max(2, os.cpu_count() or 1)
+    client, server = BFVSchemeClient(config), BFVSchemeServer(config)
+    P1, P2 = [np.random.randint(0, config.t, size=(8, config.n)) for _ in range(2)]
+    ct1, ct2 = client.encrypt_batch(P1), client.encrypt_batch(P2)
+    reference = lambda: server.mul_ciphercipher(*ct1, *ct2, client.relin_keys)
+    with LimbExecutor(workers) as executor:
+        parallel = BFVSchemeServer(config, executor=executor)
+        new = lambda: parallel.mul_ciphercipher(*ct1, *ct2, client.relin_keys)
+        assert all([np.array_equal(r.to_coeff().residues, m.to_coeff().residues) for r, m in zip(reference(), new())]), "limb executor mismatch"
+        report(f"mul x8, {workers} workers ({os.cpu_count()} cores)", timeit(reference, 3), timeit(new, 3))
+
+def bench_circuit(config: BFVSchemeConfiguration):
+    """pairwise products of 4 readings summed, plus calibrations: op by op server calls vs compiled circuit"""
+    client, server = BFVSchemeClient(config), BFVSchemeServer(config)
+    X = [np.random.randint(0, config.t, size=config.n) for _ in range(4)]
+    C = [np.random.randint(0, config.t, size=config.n) for _ in range(2)]
+    cts = [client.encrypt(x) for x in X]
+    pairs = [(i, j) for i in range(4) for j in range(i + 1, 4)]
+    def reference():
+        total = server.mul_ciphercipher(*cts[0], *cts[1], client.relin_keys)
+        for i, j in pairs[1:]:
+            total = server.add_ciphercipher(*total, *server.mul_ciphercipher(*cts[i], *cts[j], client.relin_keys))
+        for c in C:
+            total = server.add_cipherplain(*total, c)
+        return total
+    circuit = Circuit(config)
+    wires = [circuit.input(f"x{i}") for i in range(4)]
+    total = circuit.mul_ciphercipher(wires[0], wires[1])
+    for i, j in pairs[1:]:
+        total = circuit.add_ciphercipher(total, circuit.mul_ciphercipher(wires[i], wires[j]))
+    for c in C:
+        total = circuit.add_cipherplain(total, c)
+    circuit.output("total", total)
+    program = circuit.compile()
+    inputs = {f"x{i}": ct for i, ct in enumerate(cts)}
+    workers = os.cpu_count() or 1
+    new = lambda: program.run(server, inputs, client.relin_keys, workers=workers)["total"]
+    expected = (sum([X[i] * X[j] for i, j in pairs]) + sum(C)) % config.t
+    assert np.array_equal(client.decrypt(*reference()).astype(int), expected), "op by op mismatch"
+    assert np.array_equal(client.decrypt(*new()).astype(int), expected), "compiled circuit mismatch"
+    print(f"{'compiled circuit':<40} {program.stats}")
+    report(f"circuit, 6 products ({workers} threads)", timeit(reference, 3), timeit(new, 3))
+
+def bench_deg2(config: BFVSchemeConfiguration, terms: int = 8):
+    """inner product of ciphertext vectors: relinearize every product vs sum degree-2 products, relinearize once"""
+    client, server = BFVSchemeClient(config), BFVSchemeServer(config)
+    X, Y = [[np.random.randint(0, config.t, size=config.n) for _ in range(terms)] for _ in range(2)]
+    cx, cy = [client.encrypt(x) for x in X], [client.encrypt(y) for y in Y]
+    def reference():
+        total = server.mul_ciphercipher(*cx[0], *cy[0], client.relin_keys)
+        for a, b in zip(cx[1:], cy[1:]):
+            total = server.add_ciphercipher(*total, *server.mul_ciphercipher(*a, *b, client.relin_keys))
+        return total
+    def new():
+        total = server.mul_ciphercipher_deg2(*cx[0], *cy[0])
+        for a, b in zip(cx[1:], cy[1:]):
+            total = server.add_deg2(*total, *server.mul_ciphercipher_deg2(*a, *b))
+        return total
+    expected = sum([x * y for x, y in zip(X, Y)]) % config.t
+    assert np.array_equal(client.decrypt(*reference()).astype(int), expected), "relinearized sum mismatch"
+    assert np.array_equal(client.decrypt_deg2(*new()).astype(int), expected), "degree-2 sum mismatch"
+    assert np.array_equal(client.decrypt(*server.relinearize(*new(), client.relin_keys)).astype(int), expected), "relinearized degree-2 sum mismatch"
+    report(f"inner product of {terms}", timeit(reference, 3), timeit(lambda: server.relinearize(*new(), client.relin_keys), 3))
+
+def bench_sum_slots(config: BFVSchemeConfiguration):
+    """total of all slots in every slot: n/2 - 1 rotations by one step (plus the row swap) vs log2(n) rotations"""
+    client, server = BFVSchemeClient(config), BFVSchemeServer(config)
+    galois_keys = client.gen_galois_keys()
+    v = np.random.randint(0, config.t, size=config.n)
+    A, B = client.encrypt(v)
+    def reference():
+        total, rotated = (A, B), (A, B)
+        for _ in range(config.n // 2 - 1):
+            rotated = server.rotate(*rotated, 1, galois_keys)
+            total = server.add_ciphercipher(*total, *rotated)
+        return server.add_ciphercipher(*total, *server.rotate_rows(*total, galois_keys))
+    new = lambda: server.sum_slots(A, B, galois_keys)
+    expected = int(v.sum()) % config.t
+    assert (client.decrypt(*reference()).astype(int) == expected).all() and (client.decrypt(*new()).astype(int) == expected).all(), "slot sum mismatch"
+    report("sum_slots", timeit(reference), timeit(new, 3))
+
+def bench_serialization(config: BFVSchemeConfiguration):
+    """relin key loading: unpickling object arrays of RNSIntegers vs memory mapping the binary limb matrix"""
+    client = BFVSchemeClient(config)
+    pickled = pickle.dumps([(A.to_RNSIntegers(), B.to_RNSIntegers()) for A, B in client.relin_keys])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "relin_keys.bin")
+        serialization.save_relin_keys(path, client.relin_keys, config)
+        loaded = serialization.load_relin_keys(path, config)
+        assert all([np.array_equal(A.residues, L.residues) for (A, _), (L, _) in zip(client.relin_keys, loaded)]), "relin key round trip mismatch"
+        assert all([isinstance(B.residues.base, np.memmap) for _, B in loaded]), "relin keys were copied while loading"
+        print(f"{'relin key size':<40} pickled {len(pickled):10d} B   binary {os.path.getsize(path):10d} B")
+        report("relin key loading", timeit(lambda: pickle.loads(pickled), 3), timeit(lambda: serialization.load_relin_keys(path, config), 5))
+
+def bench_seeded(config: BFVSchemeConfiguration, batch: int = 8):
+    """bytes on the wire: full ciphertexts and relin keys vs seed compressed A halves (expanded by the receiver)"""
+    client = BFVSchemeClient(config, seeded=True)
+    P = np.random.randint(0, config.t, size=(batch, config.n))
+    A, B = client.encrypt_batch(P)
+    full = serialization.ciphertext_to_bytes(RNSPolynomial(A.residues, A.basis), B, config)
+    compressed = serialization.ciphertext_to_bytes(A, B, config)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "relin_keys.bin")
+        serialization.save_relin_keys(path, client.relin_keys, config, np.uint32)
+        key_bytes = os.path.getsize(path)
+        serialization.save_relin_keys(path, [(RNSPolynomial(A_i.residues, A_i.basis), B_i) for A_i, B_i in client.relin_keys], config, np.uint32)
+        full_key_bytes = os.path.getsize(path)
+    print(f"{f'ciphertext x{batch} size':<40} full {len(full):10d} B   seeded {len(compressed):10d} B")
+    print(f"{'relin key size':<40} full {full_key_bytes:10d} B   seeded {key_bytes:10d} B")
+    def receive():
+        A_rx, B_rx = serialization.ciphertext_from_bytes(compressed, config)
+        return client.decrypt_batch(A_rx, B_rx)
+    assert np.array_equal(receive().astype(int), P), "seeded ciphertext mismatch"
+    report("receive + decrypt (A from seed)", timeit(lambda: client.decrypt_batch(*serialization.ciphertext_from_bytes(full, config)), 3), timeit(receive, 3))
+
+def bench_streaming(config: BFVSchemeConfiguration):
+    """sensor stream: one encrypt + serialize call per n readings vs the batched threaded pipeline, at growing lengths"""
+    client = BFVSchemeClient(config, seeded=True)
+    for vectors in (16, 64, 256):
+        readings = np.random.randint(0, config.t, size=vectors * config.n)
+        def reference():
+            return [serialization.ciphertext_to_bytes(*client.encrypt(v), config) for v in readings.reshape(vectors, config.n)]
+        stats = StreamStats()
+        received = list(encrypt_stream(client, iter(readings), stats=stats))
+        assert np.array_equal(np.concatenate(list(decrypt_stream(client, iter(received)))), readings), "stream mismatch"
+        reference_s = timeit(reference)
+        print(f"{f'stream of {len(readings)} readings':<40} reference {len(readings)/reference_s:10.0f} readings/s   pipeline {stats.readings_per_second:10.0f} readings/s")
+
+def bench_noise_planner(config: BFVSchemeConfiguration):
+    """ct ct multiply (depth 1): q of --qbits vs the smallest q the noise planner recommends"""
+    plan = plan_parameters(config.t, 1, config.n, ternary=config.ternary)
+    planned = BFVSchemeConfiguration(config.t, plan["desired_q_numbits"], config.n, config.ternary)
+    times = []
+    for cfg in (config, planned):
+        client, server = BFVSchemeClient(cfg), BFVSchemeServer(cfg)
+        v1, v2 = np.random.randint(0, cfg.t, size=(2, cfg.n))
+        A1, B1 = client.encrypt(v1)
+        A2, B2 = client.encrypt(v2)
+        A, B = server.mul_ciphercipher(A1, B1, A2, B2, client.relin_keys)
+        assert np.array_equal(client.decrypt(A, B), v1 * v2 % cfg.t), "planned parameters do not decrypt"
+        times.append(timeit(lambda: server.mul_ciphercipher(A1, B1, A2, B2, client.relin_keys), 5))
+    print(f"{'planned q':<40} {len(config.basis_q)} -> {len(planned.basis_q)} q residues, predicted budget {plan['predicted_budget_bits']} bits")
+    report("mul_ciphercipher at the planned q", *times)
+
+def bench_leveled(config: BFVSchemeConfiguration):
+    """second ct ct multiply of a depth 2 product and its download: at the full q vs switched down the modulus chain
+    (to the lowest level the noise planner gives one more multiply, then to level 0 for the download)
+    """
+    leveled = BFVSchemeConfiguration(config.t, config.desired_q_numbits, config.n, config.ternary, leveled=True)
+    client, server = BFVSchemeClient(leveled), BFVSchemeServer(leveled)
+    v1, v2 = np.random.randint(0, config.t, size=(2, config.n))
+    A, B = server.mul_ciphercipher(*client.encrypt(v1), *client.encrypt(v2), client.relin_keys)
+    qbits = plan_parameters(config.t, 1, config.n, ternary=config.ternary)["desired_q_numbits"]
+    level = min([cfg.level for cfg in leveled.level_configs if cfg.q >= 2**qbits])
+    Al, Bl = server.mod_switch_to(A, B, level)
+    expected = (v1 * v2) ** 2 % config.t
+    for X, Y in (server.mul_ciphercipher(A, B, A, B, client.relin_keys), server.mul_ciphercipher(Al, Bl, Al, Bl, client.relin_keys)):
+        assert np.array_equal(client.decrypt(X, Y), expected), "leveled product mismatch"
+    reference = timeit(lambda: server.mul_ciphercipher(A, B, A, B, client.relin_keys), 5)
+    new = timeit(lambda: server.mul_ciphercipher(Al, Bl, Al, Bl, client.relin_keys), 5)
+    report(f"mul_ciphercipher at level {level} of {leveled.max_level}", reference, new)
+    # a compiled circuit runs at the level of its inputs
+    c = np.random.randint(0, config.t, size=config.n)
+    circuit = Circuit(leveled)
+    x = circuit.input("x")
+    circuit.output("y", circuit.add_cipherplain(circuit.mul_ciphercipher(x, x), c))
+    program = circuit.compile()
+    Y = program.run(server, {"x": (Al, Bl)}, client.relin_keys)["y"]
+    assert leveled.config_of(Y[0]).level == level, "circuit output left the level of its inputs"
+    assert np.array_equal(client.decrypt(*Y), (expected + c) % config.t), "leveled circuit mismatch"
+    reference = timeit(lambda: program.run(server, {"x": (A, B)}, client.relin_keys), 5)
+    new = timeit(lambda: program.run(server, {"x": (Al, Bl)}, client.relin_keys), 5)
+    report(f"compiled circuit at level {level} of {leveled.max_level}", reference, new)
+    full = serialization.ciphertext_to_bytes(A, B, leveled)
+    bottom = serialization.ciphertext_to_bytes(*server.mod_switch_to(Al, Bl, 0), leveled)
+    print(f"{'download size':<40} top {len(full):10d} B   level 0 {len(bottom):10d} B")
+
+BENCHMARKS = {
+    "fastBconv": bench_fastBconv,
+    "scale_down": bench_scale_down,
+    "batch_encode": bench_batch_encode,
+    "relinearization": bench_relinearization,
+    "conversion_cache": bench_conversion_cache,
+    "param_cache": bench_param_cache,
+    "uniform_sampling": bench_uniform_sampling,
+    "encrypt": bench_encrypt,
+    "decrypt": bench_decrypt,
+    "crt": bench_crt,
+    "batch_api": bench_batch_api,
+    "limb_executor": bench_limb_executor,
+    "circuit": bench_circuit,
+    "deg2": bench_deg2,
+    "sum_slots": bench_sum_slots,
+    "serialization": bench_serialization,
+    "seeded": bench_seeded,
+    "streaming": bench_streaming,
+    "noise_planner": bench_noise_planner,
+    "leveled": bench_leveled,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the BFV model kernels against their reference implementations.')
+    parser.add_argument('--t', type=int, default=257, help='Plaintext modulus (prime number), default: 257')
+    parser.add_argument('--n', type=int, default=128, help='Polynomial degree (power of 2), default: 128')
+    parser.add_argument('--qbits', type=int, default=300, help='Bit-length of ciphertext modulus q, default: 300')
+    parser.add_argument('--bench', choices=list(BENCHMARKS) + ['all'], default='all', help='Benchmark to run (or "all")')
+    args = parser.parse_args()
+
+    config = BFVSchemeConfiguration(args.t, args.qbits, args.n, False)
+    print(f"n = {config.n}, |q| = {len(config.RNS_basis_q)} residues, |qBBa| = {len(config.RNS_basis_qBBa)} residues")
+    benches = BENCHMARKS.values() if args.bench == 'all' else [BENCHMARKS[args.bench]]
+    for bench in benches:
+        bench(config)
+
+
+if __name__ == "__main__":
+    main()
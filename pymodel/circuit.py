@@ -0,0 +1,290 @@
+# circuit.py
+"""
+Record a BFV computation as a DAG of server operations, optimize it as a whole and run it
+
+    circuit = Circuit(config)
+    temp, humidity = circuit.input("temp"), circuit.input("humidity")
+    score = circuit.add_ciphercipher(temp, humidity)
+    circuit.output("score", circuit.mul_cipherplain(score, weights))
+    program = circuit.compile()
+    results = program.run(server, {"temp": temp_enc, "humidity": humidity_enc}, client.relin_keys, workers=4)
+
+compile() rewrites the recorded graph (only nodes an output depends on are kept):
+- common subexpression elimination: identical nodes (same op, same operands in any order for the commutative
+  ops, equal plaintexts) are merged
+- add chain fusion: chains of ct ct / ct pt additions whose partial sums are not used elsewhere become one n-ary
+  sum (a single reduction per residue, the plaintexts are summed mod t and encoded and scaled by Delta once)
+- hoisted mod-raise: every ciphertext used by ct ct multiplications is raised q -> qBBa once
+- deferred relinearization: ct ct products stay degree 2 (D0, D1, D2) through additions and ct pt products and
+  are relinearized when a ct ct multiplication or an output needs them (a sum of products is relinearized once);
+  a value that is relinearized for one consumer is used relinearized by all of them (never relinearized twice)
+run() executes independent nodes concurrently on a thread pool (NumPy releases the GIL in its kernels),
+a server with a limb_executor.LimbExecutor also splits the limbs of each multiplication across processes
+Deferring relinearization changes the ciphertext bits (fewer relinearization noise terms), not the decryption
+"""
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from rns_polynomial import RNSPolynomial
+
+class Wire:
+    def __init__(self, circuit, index: int):
+        """handle of a recorded ciphertext value, returned by the Circuit recording methods"""
+        self.circuit = circuit
+        self.index = index
+
+    def __repr__(self):
+        op = self.circuit._nodes[self.index][0]
+        return f"Wire({self.index}, {op})"
+
+
+class Circuit:
+    # recorded operations, the commutative ones have their operands sorted for the CSE key
+    OPS = ("input", "add_ciphercipher", "add_cipherplain", "mul_cipherplain", "mul_ciphercipher")
+    COMMUTATIVE = ("add_ciphercipher", "mul_ciphercipher")
+
+    def __init__(self, config):
+        """empty circuit for the scheme config (plaintexts are reduced mod config.t when recorded)"""
+        self.config = config
+        # node i: (op, operand node indices, input name or plaintext index)
+        self._nodes = []
+        self._plains = []
+        self._outputs = dict()
+
+    def _record(self, op: str, args: tuple, const=None) -> Wire:
+        for w in args:
+            assert isinstance(w, Wire) and w.circuit is self, "operands must be wires of this circuit"
+        self._nodes.append((op, tuple(w.index for w in args), const))
+        return Wire(self, len(self._nodes) - 1)
+
+    def _plain(self, P) -> int:
+        P = np.asarray(P).astype(np.int64) % self.config.t
+        assert P.shape[-1] == self.config.n and P.ndim <= 2, "plaintexts must be (n,) or (batch, n) slot arrays"
+        self._plains.append(P)
+        return len(self._plains) - 1
+
+    def input(self, name: str) -> Wire:
+        """ciphertext input, supplied as inputs[name] = (A, B) when running"""
+        assert all([not (op == "input" and const == name) for op, _, const in self._nodes]), f"duplicate input {name}"
+        return self._record("input", (), name)
+
+    def add_ciphercipher(self, x: Wire, y: Wire) -> Wire:
+        return self._record("add_ciphercipher", (x, y))
+
+    def add_cipherplain(self, x: Wire, P) -> Wire:
+        return self._record("add_cipherplain", (x,), self._plain(P))
+
+    def mul_cipherplain(self, x: Wire, P) -> Wire:
+        return self._record("mul_cipherplain", (x,), self._plain(P))
+
+    def mul_ciphercipher(self, x: Wire, y: Wire) -> Wire:
+        return self._record("mul_ciphercipher", (x, y))
+
+    def output(self, name: str, x: Wire):
+        """mark x as a result, run() returns it (relinearized) as outputs[name] = (A, B)"""
+        assert isinstance(x, Wire) and x.circuit is self, "outputs must be wires of this circuit"
+        self._outputs[name] = x.index
+
+    def _eliminate_common_subexpressions(self) -> tuple:
+        """(canonical node of every recorded node, number of merged nodes)"""
+        canonical, seen = [], dict()
+        for op, args, const in self._nodes:
+            args = tuple(canonical[a] for a in args)
+            if op in Circuit.COMMUTATIVE:
+                args = tuple(sorted(args))
+            if op in ("add_cipherplain", "mul_cipherplain"):
+                P = self._plains[const]
+                const_key = (P.shape, P.tobytes())
+            else:
+                const_key = const
+            canonical.append(seen.setdefault((op, args, const_key), len(canonical)))
+        return canonical, len(canonical) - len(set(canonical))
+
+    def compile(self) -> "CompiledCircuit":
+        return CompiledCircuit(self)
+
+
+class CompiledCircuit:
+    # instructions: ("input", name), ("sum", terms, plaintext or None), ("mul_plain", src, plaintext),
+    # ("mod_raise", src), ("tensor", raised1, raised2), ("relin", src)
+    # values are tuples of RNSPolynomials: (A, B) for degree 1, (D1, D0, D2) for degree 2 (so that the first two
+    # components add like (A, B) and relinearization maps (D1, D0, D2) to (D1, D0) + D2 * RLev)
+
+    def __init__(self, circuit: Circuit):
+        """lowers the recorded graph of circuit to an optimized instruction list (see the module docstring)"""
+        self.config = circuit.config
+        self.instructions = []
+        self.degrees = []
+        self._memo = dict()
+        nodes, plains = circuit._nodes, circuit._plains
+        canonical, merged = circuit._eliminate_common_subexpressions()
+        outputs = {name: canonical[i] for name, i in circuit._outputs.items()}
+        # uses of every live canonical node by the other live nodes and the outputs
+        live, stack = set(), list(outputs.values())
+        while stack:
+            i = stack.pop()
+            if i not in live:
+                live.add(i)
+                stack += [canonical[a] for a in nodes[i][1]]
+        uses = dict()
+        for i in live:
+            for a in nodes[i][1]:
+                uses[canonical[a]] = uses.get(canonical[a], 0) + 1
+        for i in outputs.values():
+            uses[i] = uses.get(i, 0) + 1
+        self.stats = {"recorded_nodes": len(nodes), "cse_merged": merged, "fused_additions": 0}
+        lowered = dict()
+        # nodes needed in degree 1 anyway (outputs and ct ct multiplicands): their other consumers (sums, ct pt
+        # products) take the relinearized value too, rather than relinearizing a second time further down
+        relinearized = set(outputs.values())
+        for i in live:
+            if nodes[i][0] == "mul_ciphercipher":
+                relinearized.update(canonical[a] for a in nodes[i][1])
+
+        def operand(a: int) -> int:
+            k = lower(a)
+            return self._degree1(k) if a in relinearized else k
+
+        def fusable(i: int) -> bool:
+            return nodes[i][0] in ("add_ciphercipher", "add_cipherplain") and uses.get(i, 0) == 1
+
+        def lower(i: int) -> int:
+            if i in lowered:
+                return lowered[i]
+            op, args, const = nodes[i]
+            args = [canonical[a] for a in args]
+            if op == "input":
+                lowered[i] = self._emit(("input", const), 1)
+            elif op in ("add_ciphercipher", "add_cipherplain"):
+                # flatten the chain: partial sums used only here are folded into this sum
+                terms, plain, stack = [], None, [i]
+                while stack:
+                    j = stack.pop()
+                    op_j, args_j, const_j = nodes[j]
+                    if op_j == "add_cipherplain":
+                        plain = plains[const_j] if plain is None else (plain + plains[const_j]) % self.config.t
+                    for a in args_j:
+                        a = canonical[a]
+                        if fusable(a):
+                            self.stats["fused_additions"] += 1
+                            stack.append(a)
+                        else:
+                            terms.append(operand(a))
+                terms = tuple(sorted(terms))
+                lowered[i] = self._emit(("sum", terms, plain), max([self.degrees[k] for k in terms]))
+            elif op == "mul_cipherplain":
+                src = operand(args[0])
+                lowered[i] = self._emit(("mul_plain", src, plains[const]), self.degrees[src])
+            elif op == "mul_ciphercipher":
+                raised = sorted([self._emit(("mod_raise", self._degree1(lower(a))), 1) for a in args])
+                lowered[i] = self._emit(("tensor", *raised), 2)
+            return lowered[i]
+
+        self.outputs = {name: self._degree1(lower(i)) for name, i in outputs.items()}
+        ops = [ins[0] for ins in self.instructions]
+        self.stats.update({
+            "instructions": len(self.instructions),
+            "mod_raises": ops.count("mod_raise"),
+            "tensor_products": ops.count("tensor"),
+            "relinearizations": ops.count("relin"),
+        })
+        # consumers of every instruction (the scheduler runs an instruction once all of its operands are ready)
+        self.operands = [self._operands(ins) for ins in self.instructions]
+        self.consumers = [[] for _ in self.instructions]
+        for k, ops_k in enumerate(self.operands):
+            for a in set(ops_k):
+                self.consumers[a].append(k)
+        del self._memo
+
+    def _emit(self, instruction: tuple, degree: int) -> int:
+        """index of instruction, added unless an identical one (same operands) exists"""
+        op, *rest = instruction
+        key = (op,) + tuple((P.shape, P.tobytes()) if isinstance(P, np.ndarray) else P for P in rest)
+        if key not in self._memo:
+            self.instructions.append(instruction)
+            self.degrees.append(degree)
+            self._memo[key] = len(self.instructions) - 1
+        return self._memo[key]
+
+    def _degree1(self, k: int) -> int:
+        return k if self.degrees[k] == 1 else self._emit(("relin", k), 1)
+
+    @staticmethod
+    def _operands(instruction: tuple) -> list:
+        op, *rest = instruction
+        if op == "input":
+            return []
+        if op == "sum":
+            return list(rest[0])
+        return [a for a in rest if isinstance(a, int)]
+
+    def _execute(self, k: int, server, inputs: dict, RLev, values: dict) -> tuple:
+        op, *rest = self.instructions[k]
+        if op == "input":
+            A, B = inputs[rest[0]]
+            server.config.validate_AB(A, B)
+            return A, B
+        if op == "sum":
+            terms, plain = [values[a] for a in rest[0]], rest[1]
+            summed = [RNSPolynomial.sum([x[c] for x in terms if len(x) > c]) for c in range(max([len(x) for x in terms]))]
+            if plain is not None:
+                # sum(Delta * encode(P_i)) = Delta * encode(sum P_i mod t), as t divides q
+                summed[1] += server._encode_plain(plain).mul_constant_residues(server.config.Delta_residues_q)
+            return tuple(summed)
+        if op == "mul_plain":
+            encoded_pt = server._encode_plain(rest[1])
+            return tuple(server.polynomial_mul(x, encoded_pt) for x in values[rest[0]])
+        if op == "mod_raise":
+            return server._mod_raise(*values[rest[0]])
+        if op == "tensor":
+            D0, D1, D2 = server._tensor_product(*values[rest[0]], *values[rest[1]])
+            return D1, D0, D2
+        if op == "relin":
+            D1, D0, D2 = values[rest[0]]
+            return server.relinearize(D0, D1, D2, RLev)
+        raise ValueError(f"unknown instruction {op}")
+
+    def run(self, server, inputs: dict, RLev=None, workers: int = None) -> dict:
+        """evaluates the circuit with server on inputs (name -> ciphertext (A, B), single or stacked)
+        RLev (relinearization keys) is required if the circuit has ct ct multiplications
+        workers > 1 runs ready instructions concurrently on a thread pool, intermediates are freed once consumed
+        Mod switched inputs run the circuit at their level of the modulus chain (every input must be at the same one)
+        returns output name -> ciphertext (A, B)
+        """
+        if inputs:
+            server = server._for_level_of(next(iter(inputs.values()))[0])
+        if self.stats["relinearizations"]:
+            assert RLev is not None, "the circuit needs relinearization keys"
+            server._get_relin_keys_eval(RLev) # transform the keys before any thread needs them
+        values = dict()
+        pending = [len(set(ops)) for ops in self.operands]
+        remaining_uses = [len(c) for c in self.consumers]
+        keep = set(self.outputs.values())
+
+        def done(k: int, value: tuple) -> list:
+            """stores the value of k, frees operands nobody needs anymore and returns the instructions now ready"""
+            values[k] = value
+            for a in set(self.operands[k]):
+                remaining_uses[a] -= 1
+                if remaining_uses[a] == 0 and a not in keep:
+                    del values[a]
+            ready = []
+            for c in self.consumers[k]:
+                pending[c] -= 1
+                if pending[c] == 0:
+                    ready.append(c)
+            return ready
+
+        ready = [k for k, p in enumerate(pending) if p == 0]
+        if workers is None or workers <= 1:
+            while ready:
+                k = ready.pop()
+                ready += done(k, self._execute(k, server, inputs, RLev, values))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                running = {pool.submit(self._execute, k, server, inputs, RLev, values): k for k in ready}
+                while running:
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        for c in done(running.pop(f), f.result()):
+                            running[pool.submit(self._execute, c, server, inputs, RLev, values)] = c
+        return {name: values[k] for name, k in self.outputs.items()}
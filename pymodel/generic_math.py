@@ -1,14 +1,44 @@
 # generic_math.py
-import sympy
+# sympy is only imported by the functions that search for parameters (gen_RNS_basis, batch_encoding_root, ...),
+# so a BFVSchemeConfiguration loaded from the parameter cache never imports it
 import numpy as np
 import math
+import hashlib
 import random
 from collections.abc import Iterable
 import copy
-from ntt_friendly_prime import negacyclic_moduli
+from ntt_friendly_prime import get_negacyclic_pool, get_prime_pool, convert_primesize_to_kmultiple
+from base_conversion import get_fastBconv, get_modswitch, get_fastBconvEx, get_crt_reconstruction
+
+# Miller-Rabin with the first 12 prime bases is deterministic below this bound (covers every residue prime)
+_MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)
+_MILLER_RABIN_BOUND = 3317044064679887385961981
 
 def is_prime(x) -> bool:
-    return bool(sympy.isprime(x))
+    x = int(x)
+    if x < 2:
+        return False
+    for p in _MILLER_RABIN_BASES:
+        if x % p == 0:
+            return x == p
+    if x >= _MILLER_RABIN_BOUND:
+        import sympy
+        return bool(sympy.isprime(x))
+    d, s = x - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in _MILLER_RABIN_BASES:
+        y = pow(a, d, x)
+        if y == 1 or y == x - 1:
+            continue
+        for _ in range(s - 1):
+            y = y * y % x
+            if y == x - 1:
+                break
+        else:
+            return False
+    return True
 
 def is_odd(x) -> bool:
     return bool(x % 2 == 1)
@@ -28,16 +58,22 @@ def bit_reverse_perm(n):
     bits = int(math.log2(n))
     return [int(f"{i:0{bits}b}"[::-1], 2) for i in range(n)]
 
+def batch_encoding_root(n: int, t: int) -> int:
+    """primitive 2n-th root of unity omega mod t used by batch encoding (slot i holds m(omega^(2i+1)))"""
+    import sympy
+    g = sympy.primitive_root(t)
+    return pow(g, (t - 1) // (2 * n), t)
+
 def batch_encode_decode_matrices(n: int, t: int) -> tuple[np.ndarray,np.ndarray]:
     """returns a tuple with [0] encode matrix and [1] decode matrix"""
     assert is_prime(t) and (t - 1) % (2 * n) == 0, "bad modulus"
     # build W_transpose (decoding) and E = (W_transpose)^-1 (encoding) matrices
-    g = sympy.primitive_root(t)
-    omega = pow(g, (t - 1) // (2 * n), t) # primitive 2n-th root
+    omega = batch_encoding_root(n, t) # primitive 2n-th root
     alpha = np.array([pow(omega, 2 * k + 1, t) for k in range(n)], dtype=object)
     # Vandermonde in increasing powers: (row i, col j) = alpha_i^j   (mod t)
     W_T = np.vander(alpha, N=n, increasing=True) % t # (n x n)
     # inverse with SymPy (modular)
+    import sympy
     E = np.array(sympy.Matrix(W_T.tolist()).inv_mod(t).tolist(), dtype=object)
     return E, W_T
 
@@ -53,6 +89,61 @@ def gen_uniform_rand_arr(lower_bound: int, upper_bound: int, size: int):
     # Convert to np.array with dtype object so Python ints are preserved
     return np.array(data, dtype=object)
 
+def gen_uniform_rand_residues(moduli: Iterable[int], size: int) -> np.ndarray:
+    """Generate a (len(moduli), size) uint64 matrix whose row i is uniform in [0, moduli[i])
+    By the CRT this is a uniform sample mod prod(moduli) in RNS form (no bigints involved)
+    Every modulus must fit in 32 bits: 32 bit words are drawn with np.random and each row keeps
+    the words below the largest multiple of its modulus (rejection sampling, so no modulo bias)
+    """
+    n = int(size)
+    moduli = [int(p) for p in moduli]
+    assert all([1 < p <= 2**32 for p in moduli]), "moduli must fit in 32 bits"
+    p = np.array(moduli, dtype=np.uint64).reshape(-1, 1)
+    limit = np.array([(2**32 // m) * m for m in moduli], dtype=np.uint64).reshape(-1, 1) # acceptance rate > 1/2
+    # one draw for every row, sized so that every row almost surely accepts n words
+    draws = int(n * 2**32 / int(limit.min())) + 6 * int(math.isqrt(n)) + 16
+    words = np.random.randint(0, 2**32, size=(len(moduli), draws), dtype=np.uint64)
+    accept = words < limit
+    # stable sort moves the accepted words of each row to the front, in draw order
+    first = np.take_along_axis(words, np.argsort(~accept, axis=1, kind="stable")[:, :n], axis=1)
+    res = first % p
+    # top up the (rare) rows that rejected too many words
+    for i in np.flatnonzero(accept.sum(axis=1) < n):
+        filled = int(accept[i].sum())
+        while filled < n:
+            extra = np.random.randint(0, 2**32, size=n - filled + 16, dtype=np.uint64)
+            extra = extra[extra < limit[i]][:n - filled]
+            res[i, filled:filled + len(extra)] = extra % p[i]
+            filled += len(extra)
+    return res
+
+def xof_uniform_residues(seed: bytes, moduli: Iterable[int], size: int) -> np.ndarray:
+    """Deterministic counterpart of gen_uniform_rand_residues: row i of the (len(moduli), size) matrix reads
+    little-endian 32 bit words from the XOF shake_128(seed || i) and keeps the words below the largest multiple
+    of moduli[i] (then reduced mod moduli[i]), so the same seed expands to the same residues everywhere
+    """
+    n = int(size)
+    res = np.empty((len(moduli), n), dtype=np.uint64)
+    for i, p in enumerate(moduli):
+        p = int(p)
+        assert 1 < p <= 2**32, "moduli must fit in 32 bits"
+        limit = (2**32 // p) * p
+        xof = hashlib.shake_128(bytes(seed) + i.to_bytes(4, "little"))
+        draws = int(n * 2**32 / limit) + 6 * int(math.isqrt(n)) + 16
+        while True:
+            # an XOF output is a prefix of every longer output, so growing the draw keeps the accepted words
+            words = np.frombuffer(xof.digest(4 * draws), dtype="<u4").astype(np.uint64)
+            words = words[words < limit]
+            if len(words) >= n:
+                break
+            draws *= 2
+        res[i] = words[:n] % np.uint64(p)
+    return res
+
+def xof_child_seed(seed: bytes, index: int) -> bytes:
+    """seed of polynomial number index of a stack expanded from seed"""
+    return hashlib.shake_128(b"stack" + bytes(seed) + int(index).to_bytes(8, "little")).digest(len(seed))
+
 def nparr_int_round(dividend: np.ndarray, divisor: int) -> np.ndarray:
     """
     Return np.array of nearest‐integer rounding of dividend/divisor without using floating point,
@@ -64,7 +155,7 @@ def nparr_int_round(dividend: np.ndarray, divisor: int) -> np.ndarray:
     half = divisor >> 1
     return (dividend+half) // divisor
 
-def gen_RNS_basis(lower_bound: int, max_residue_size: int, multiple_of: Iterable = None, scheme_SIMD_slots: int = None) -> np.ndarray:
+def gen_RNS_basis(lower_bound: int, max_residue_size: int, multiple_of: Iterable = None, scheme_SIMD_slots: int = None, workers: int = None) -> np.ndarray:
     """Generates a valid ResidueNumberSystem basis (a set of co-prime integers)
     RNS can be used for modulo arithmetic on very large integers. This algorithm is deterministic
 
@@ -76,6 +167,8 @@ def gen_RNS_basis(lower_bound: int, max_residue_size: int, multiple_of: Iterable
         multiple_of (Iterable, optional): ensure that RNS modulus is a multiple of these numbers
             default is None (so this is ignored)
         scheme_SIMD_slot (int, optional): if this option is specified, the function attempts to create negacyclic NTT friendly primes
+        workers (int, optional): if > 1, the prime search runs its primality tests on a process pool of that size
+            (only worth it for very large residues)
 
     Returns:
         np.ndarray: the residue basis
@@ -102,30 +195,22 @@ def gen_RNS_basis(lower_bound: int, max_residue_size: int, multiple_of: Iterable
             current_product *= multiple
         if candidate < multiple:
             candidate = multiple+1
-    # generate a bunch of NTT friendly primes (or dont if scheme_SIMD_slots=None)
+    # candidate primes come from a growable pool shared by every basis searched with the same residue size
+    # NTT friendly pool (q = k*2n+1) if scheme_SIMD_slots is given, else every odd number
     if scheme_SIMD_slots is not None:
         # You usually set scheme_SIMD_slots = N (NTT length)
-        # We grab more primes than strictly needed and then take them one by one.
-        primes_needed = int(math.ceil(math.log(lower_bound,max_residue_size))) + 20
-        prime_candidates_full_results = negacyclic_moduli(scheme_SIMD_slots, count=primes_needed, prime_size=min_residue_size)
-        ntt_friendly_candidates = sorted([mp.q for mp in prime_candidates_full_results])
-        assert ntt_friendly_candidates == sorted(ntt_friendly_candidates) and len(ntt_friendly_candidates) == len(set(ntt_friendly_candidates))
-        while candidate > ntt_friendly_candidates[0]:
-            if len(ntt_friendly_candidates) <= 1:
-                raise ValueError("No more NTT-friendly candidates available")
-            ntt_friendly_candidates.pop(0)
+        pool = get_negacyclic_pool(scheme_SIMD_slots, convert_primesize_to_kmultiple(min_residue_size, scheme_SIMD_slots), workers)
+        candidates = pool.primes_from(candidate)
+    else:
+        pool = get_prime_pool(min_residue_size | 1, 2, workers)
+        candidates = pool.primes_from(candidate + 1) # primes > candidate (like sympy.nextprime)
     # accumulate primes
-    i = 0
     while current_product < lower_bound:
-        if scheme_SIMD_slots is not None:
-            candidate = ntt_friendly_candidates[i]
-        else:
-            candidate = sympy.nextprime(candidate)
+        candidate = next(candidates)
         if candidate > max_residue_size:
             raise ValueError("Cannot reach lower_bound without exceeding max_residue_size")
         moduli.append(candidate)
         current_product *= candidate
-        i+=1
     # error check
     assert all([is_prime(m) for m in moduli]), "non prime basis modulus produced"
     assert len(set(moduli))==len(moduli), "redundant basis primes"
@@ -145,7 +230,7 @@ def compute_CRT_coefficients(RNS_basis) -> np.ndarray:
     coeffs = np.empty(k, dtype=object)
     for i in range(k):
         q_over_qi = q // moduli[i]
-        inv = sympy.mod_inverse(q_over_qi, moduli[i]) % moduli[i]
+        inv = pow(int(q_over_qi % moduli[i]), -1, int(moduli[i]))
         alpha_i = (q_over_qi * inv) % q
         coeffs[i] = alpha_i
     return coeffs
@@ -154,7 +239,7 @@ def is_pairwise_coprime(arr) -> bool:
     n = len(arr)
     for i in range(n):
         for j in range(i + 1, n):
-            if sympy.gcd(arr[i], arr[j]) != 1:
+            if math.gcd(int(arr[i]), int(arr[j])) != 1:
                 return False
     return True
 
@@ -212,11 +297,11 @@ class RNSInteger:
     #__rmul__ = mul_constant
     
     def __int__(self) -> int:
-        """Reconstruct the integer by calling SymPy's CRT.
+        """Reconstruct the integer with the (cached) CRT coefficients of the basis.
         Returns an integer in [0, modulus).
         """
-        crt_val, _ = sympy.ntheory.modular.crt(list(map(int, self.basis)), list(map(int, self.residues)), symmetric=False)
-        return int(crt_val)
+        residues = np.array(self.residues, dtype=object).reshape(-1, 1)
+        return int(get_crt_reconstruction(self.basis).reconstruct(residues)[0])
     
     def __add__(self, other):
         assert np.array_equal(self.basis, other.basis), "Basis mismatch in addition"
@@ -260,13 +345,9 @@ class RNSInteger:
         return out
     
     def fastBconv(self, target_basis: Iterable[int]) -> "RNSInteger":
-        # precompute
-        q = self.modulus
-        y  = [q // qi for qi in self.basis] # yi = q/qi
-        z  = [sympy.mod_inverse(yi, qi) for yi, qi in zip(y, self.basis)] # zi = yi^{-1} mod qi
-        y_mod_b = list()
-        for j, bj in enumerate(target_basis):
-            y_mod_b.append([yi % bj for yi in y])
+        # precomputed (cached per basis pair): zi = yi^{-1} mod qi and yi mod bj (yi = q/qi)
+        conv = get_fastBconv(self.basis, target_basis)
+        z, y_mod_b = conv.z_list, conv.y_mod_b_list
         # Hardware step
         a  = [(xi * zi) % qi for xi, zi, qi in zip(self.residues, z, self.basis)]  # ai
         c_res = []
@@ -282,13 +363,11 @@ class RNSInteger:
     def modswitch(self, drop_modulis):
         """going from a bigger basis (d and f) to a subset basis f"""
         drop_modulis = list(map(int, drop_modulis))
-        keep_idx = [i for i,m in enumerate(self.basis) if m not in drop_modulis]
-        drop_idx = [i for i,m in enumerate(self.basis) if m in drop_modulis]
-        f_basis = self.basis[keep_idx].astype(object)
+        f_basis = np.array([m for m in self.basis if m not in drop_modulis], dtype=object)
+        # Pre-computed constants (cached per basis pair)
+        ms = get_modswitch(self.basis, f_basis)
+        keep_idx, drop_idx, finv = ms.keep_idx, ms.drop_idx, ms.finv_list
         d_basis = self.basis[drop_idx].astype(object)
-        # Pre-compute constants
-        d = int(np.prod(d_basis))
-        finv = [sympy.mod_inverse(d, fi) % fi for fi in f_basis]
         # Fast base convert the "to-be-dropped" part onto the q-basis
         x_d = RNSInteger._from_residues(self.residues[drop_idx], d_basis)
         xhat_f = x_d.fastBconv(f_basis).residues
@@ -312,18 +391,13 @@ class RNSInteger:
         """Exact fast base conversion (FastBConvEx) from the union base
         B union B_a (which equals self.basis) to target_basis (= B union B_a).
         """
-        # error checking
         B = np.array(aux_modulis_B, dtype=object)
         Ba = np.array(aux_modulis_Ba, dtype=object)
         q = np.array(target_basis, dtype=object)
-        assert set(B).isdisjoint(set(Ba)), "aux_modulis_B and aux_modulis_Ba must be disjoint"
-        # precalculation
-        b_bigmodulus = int(np.prod(B))
-        Ba_bigmodulus = np.prod(Ba)
-        b_inv_Ba_bigint = sympy.mod_inverse(b_bigmodulus,Ba_bigmodulus)
-        b_inv_Ba = np.array([b_inv_Ba_bigint % prime for prime in Ba], dtype=object)
-        assert len(b_inv_Ba)==1, "Ba must fit inside 1 residue"
-        b_mod_q = np.array([b_bigmodulus % int(p) for p in q], dtype=object)
+        # precalculation (cached per basis pair, also checks B and Ba are disjoint and Ba is 1 residue)
+        ex = get_fastBconvEx(self.basis, B, Ba, q)
+        b_inv_Ba = [ex.b_inv_Ba]
+        b_mod_q = np.array(ex.b_mod_q_list, dtype=object)
         #
         # step 1: mod drops
         xB = self._moddrop(B) # residues only on B
@@ -343,8 +417,12 @@ class RNSInteger:
         return RNSInteger._from_residues(result_residues, q)
 
 def polynomial_RNSmult_constant(constant: int, polyRNScoeffs: Iterable) -> np.ndarray:
-    """Create and return an np.ndarray representing the multiplication of each coefficient by the integer constant"""
+    """Create and return an np.ndarray representing the multiplication of each coefficient by the integer constant
+    (an RNSPolynomial input returns an RNSPolynomial)
+    """
     constant=int(constant)
+    if hasattr(polyRNScoeffs, "mul_constant"):
+        return polyRNScoeffs.mul_constant(constant)
     assert isinstance(polyRNScoeffs[0],RNSInteger), "expecting RNSInteger"
     result = [coef.mul_constant(constant) for coef in polyRNScoeffs]
     return np.array(result,dtype=object)
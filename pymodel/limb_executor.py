@@ -0,0 +1,146 @@
+# limb_executor.py
+"""
+Process pool that splits the per-limb (per residue prime) work of one ct ct multiplication
+RNS limbs are independent for the NTTs, tensor products and the relinearization multiply-accumulate, so
+every worker processes one contiguous group of limbs. Residue matrices are exchanged through
+multiprocessing.shared_memory buffers (workers read their input rows and write their output rows in place,
+nothing is pickled except buffer names and small constants). The cross-limb steps (fastBconv, scale-down)
+stay in the parent process and act as synchronization points between parallel stages.
+"""
+import numpy as np
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory, util
+from ntt import NegacyclicNTT, get_ntt_engine
+from modular_kernels import mod_add, mod_mul, mod_dot
+
+# worker process state: attached buffers by role, NTT engines by (primes, n, psi)
+_worker_buffers = dict()
+_worker_engines = dict()
+
+def _init_worker():
+    util.Finalize(None, _detach_all, exitpriority=0)
+
+def _detach_all():
+    for shm in _worker_buffers.values():
+        shm.close()
+    _worker_buffers.clear()
+
+def _attach(role: str, name: str, shape: tuple) -> np.ndarray:
+    """view of the current buffer of role, the previous one is closed once the parent reallocated it"""
+    shm = _worker_buffers.get(role)
+    if shm is None or shm.name != name:
+        if shm is not None:
+            shm.close()
+        # workers share the parent's resource tracker, the parent unlinks the buffer
+        shm = _worker_buffers[role] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.uint64, buffer=shm.buf)
+
+def _engine(primes: tuple, n: int, psi: tuple) -> NegacyclicNTT:
+    key = (primes, n, psi)
+    if key not in _worker_engines:
+        _worker_engines[key] = NegacyclicNTT(primes, n, psi=psi)
+    return _worker_engines[key]
+
+def _tensor_task(inp: tuple, out: tuple, lo: int, hi: int, primes: tuple, psi: tuple, n: int):
+    """(A1, B1, A2, B2) -> (D0, D1, D2) = (B1*B2, B2*A1 + B1*A2, A1*A2) on limbs lo:hi (coefficient form in and out)"""
+    X = _attach(*inp)[..., lo:hi, :]
+    engine = _engine(primes, n, psi)
+    p = engine.moduli
+    A1, B1, A2, B2 = engine.forward(X)
+    D = np.stack((mod_mul(B1, B2, p), mod_add(mod_mul(B2, A1, p), mod_mul(B1, A2, p), p), mod_mul(A1, A2, p)))
+    _attach(*out)[..., lo:hi, :] = engine.inverse(D)
+
+def _decomp_mult_task(d2: tuple, keys: tuple, out: tuple, lo: int, hi: int, primes: tuple, psi: tuple, n: int):
+    """sum_i D2_i * RLev_i for the (A, B) keys on output limbs lo:hi (every digit of D2 is read, keys are in evaluation form)"""
+    D2 = _attach(*d2)
+    RLev = _attach(*keys)[..., lo:hi, :] # (2, num_digits, g, n)
+    engine = _engine(primes, n, psi)
+    gadget_eval = engine.forward(D2[..., :, None, :] % engine.moduli)
+    total = np.stack([mod_dot(gadget_eval, RLev[j], engine.moduli, axis=-3) for j in range(2)])
+    _attach(*out)[..., lo:hi, :] = engine.inverse(total)
+
+
+class LimbExecutor:
+    def __init__(self, workers: int, mp_context=None):
+        """Process pool of `workers` processes, each ct ct multiply stage is split in `workers` limb groups
+        Use as a context manager (or call shutdown()) so the shared memory buffers are released
+        """
+        self.workers = int(workers)
+        assert self.workers >= 1, "need at least one worker"
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context, initializer=_init_worker)
+        # reusable shared buffers by role: role -> (SharedMemory, ndarray view)
+        self._buffers = dict()
+        # source array currently copied in each role (skips re-copying the relin keys)
+        self._loaded = dict()
+        # one stage at a time (the role buffers are shared, e.g. by the threads of a circuit run)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    def shutdown(self):
+        self._pool.shutdown()
+        for shm, _ in self._buffers.values():
+            shm.close()
+            shm.unlink()
+        self._buffers.clear()
+        self._loaded.clear()
+
+    def _buffer(self, role: str, shape: tuple) -> tuple:
+        """shared (role, name, shape) of the role buffer, reallocated if the shape changed (workers then drop the old one)"""
+        shape = tuple(int(d) for d in shape)
+        if role not in self._buffers or self._buffers[role][1].shape != shape:
+            if role in self._buffers:
+                self._buffers[role][0].close()
+                self._buffers[role][0].unlink()
+            size = max(8, int(np.prod(shape, dtype=np.int64)) * 8)
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            self._buffers[role] = (shm, np.ndarray(shape, dtype=np.uint64, buffer=shm.buf))
+            self._loaded.pop(role, None)
+        return role, self._buffers[role][0].name, shape
+
+    def _put(self, role: str, array: np.ndarray, cache: bool = False) -> tuple:
+        """copy array into the role buffer (only once for the same array object if cache)"""
+        ref = self._buffer(role, array.shape)
+        if not (cache and self._loaded.get(role) is array):
+            self._buffers[role][1][...] = array
+            self._loaded[role] = array if cache else None
+        return ref
+
+    def _groups(self, k: int) -> list:
+        bounds = np.linspace(0, k, min(self.workers, k) + 1).astype(int)
+        return [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    def _run(self, task, basis, n: int, out_role: str, *args) -> np.ndarray:
+        """run task on every limb group (one future each), wait for all of them and return the out_role buffer
+        workers use the parent's psi, so evaluation form operands (relin keys) agree
+        """
+        psi = tuple(get_ntt_engine(basis.primes, n).psi)
+        out = (out_role, self._buffers[out_role][0].name, self._buffers[out_role][1].shape)
+        futures = [self._pool.submit(task, *args, out, lo, hi, basis.primes[lo:hi], psi[lo:hi], n) for lo, hi in self._groups(len(basis))]
+        for f in futures:
+            f.result()
+        return self._buffers[out_role][1].copy()
+
+    def tensor_product(self, lifted: np.ndarray, basis) -> np.ndarray:
+        """(4, ..., k, n) coefficient residues of (A1, B1, A2, B2) -> (3, ..., k, n) residues of (D0, D1, D2)"""
+        n = lifted.shape[-1]
+        with self._lock:
+            inp = self._put("tensor_in", lifted)
+            self._buffer("tensor_out", (3,) + lifted.shape[1:])
+            return self._run(_tensor_task, basis, n, "tensor_out", inp)
+
+    def decomp_mult(self, D2: np.ndarray, RLev_eval: np.ndarray, basis) -> np.ndarray:
+        """(..., k, n) coefficient residues of D2 and (2, num_digits, k, n) evaluation form keys
+        -> (2, ..., k, n) coefficient residues of the relinearization sums (A, B)
+        """
+        n = D2.shape[-1]
+        with self._lock:
+            d2 = self._put("relin_d2", D2)
+            keys = self._put("relin_keys", RLev_eval, cache=True)
+            self._buffer("relin_out", (2,) + D2.shape)
+            return self._run(_decomp_mult_task, basis, n, "relin_out", d2, keys)
@@ -0,0 +1,136 @@
+# modular_kernels.py
+"""
+Vectorized word-size modular arithmetic on NumPy uint64 arrays
+Every modulus p must be smaller than 2^32, so residues fit in 32 bits and the
+product of two residues fits in a uint64 word (like a 32x32->64 bit hardware multiplier)
+Moduli are passed as arrays that broadcast against the operands, e.g. a (k, 1) column
+of primes for a (k, n) residue matrix. All functions return fully reduced values in [0, p)
+and are bit-exact with Python bigint %
+
+- mod_add/mod_sub/mod_neg use a single conditional subtraction (no division)
+- mod_mul/mod_mac/mod_reduce use NumPy's native uint64 remainder, which is the fastest exact
+  reduction available in NumPy (there is no 64x64->128 bit multiply to build Barrett from)
+- mod_mul_barrett (mu = floor(2^64 / p) per prime) and mod_mul_shoup (fixed multiplicand w with
+  w_shoup = floor(w * 2^32 / p) precomputed) are bit-exact models of the division free
+  reduction a hardware datapath would use
+"""
+import numpy as np
+
+_MASK32 = np.uint64(0xFFFFFFFF)
+_SHIFT32 = np.uint64(32)
+
+def barrett_precompute(moduli) -> np.ndarray:
+    """per-prime Barrett constant mu = floor(2^64 / p) (same shape as moduli)"""
+    moduli = np.asarray(moduli, dtype=object)
+    assert all([1 < int(p) < 2**32 for p in moduli.flatten()]), "moduli must fit in 32 bits"
+    return np.vectorize(lambda p: (2**64) // int(p), otypes=[object])(moduli).astype(np.uint64)
+
+def shoup_precompute(w, moduli) -> np.ndarray:
+    """Shoup companion of the fixed multiplicand w: floor(w * 2^32 / p), w must already be reduced mod p"""
+    w = np.asarray(w, dtype=object)
+    moduli = np.asarray(moduli, dtype=object)
+    w, moduli = np.broadcast_arrays(w, moduli)
+    assert all([0 <= int(x) < int(p) for x, p in zip(w.flatten(), moduli.flatten())]), "w must be reduced mod p"
+    return np.vectorize(lambda x, p: (int(x) << 32) // int(p), otypes=[object])(w, moduli).astype(np.uint64)
+
+def _mulhi64(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """floor(a*b / 2^64) for uint64 a, b (schoolbook product of 32 bit halves)"""
+    a_lo, a_hi = a & _MASK32, a >> _SHIFT32
+    b_lo, b_hi = b & _MASK32, b >> _SHIFT32
+    hi_lo = a_hi * b_lo
+    cross = ((a_lo * b_lo) >> _SHIFT32) + (hi_lo & _MASK32) + a_lo * b_hi
+    return a_hi * b_hi + (hi_lo >> _SHIFT32) + (cross >> _SHIFT32)
+
+def _conditional_subtract(r: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """r in [0, 2p) -> r mod p (if r < p then r-p wraps around and minimum picks r)"""
+    return np.minimum(r, r - p)
+
+def barrett_reduce(x: np.ndarray, p: np.ndarray, mu: np.ndarray) -> np.ndarray:
+    """Barrett reduction of any uint64 x"""
+    x = np.asarray(x, dtype=np.uint64)
+    r = x - _mulhi64(x, mu) * p # r in [0, 2p)
+    return _conditional_subtract(r, p)
+
+def mod_reduce(x: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """x mod p for any uint64 x"""
+    return np.asarray(x, dtype=np.uint64) % p
+
+def mod_add(a: np.ndarray, b: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """(a + b) mod p, a and b in [0, p)"""
+    return _conditional_subtract(a + b, p)
+
+def mod_sub(a: np.ndarray, b: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """(a - b) mod p, a and b in [0, p)"""
+    return _conditional_subtract(a + p - b, p)
+
+def mod_neg(a: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """(-a) mod p, a in [0, p)"""
+    return _conditional_subtract(p - a, p)
+
+def mod_mul(a: np.ndarray, b: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """(a * b) mod p, a and b in [0, p)"""
+    return (a * b) % p
+
+def mod_mac(acc: np.ndarray, a: np.ndarray, b: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """(acc + a * b) mod p, acc in [0, p) and a, b in [0, 2^32) (a*b + acc never overflows 64 bits)"""
+    return (a * b + acc) % p
+
+def mod_dot(a: np.ndarray, b: np.ndarray, p: np.ndarray, axis: int = 0) -> np.ndarray:
+    """sum_i a[i] * b[i] mod p over axis (the leading one by default). Every product is reduced, so the
+    sum of reduced 32 bit words can not overflow 64 bits
+    """
+    return np.sum(mod_mul(a, b, p), axis=axis) % p
+
+def mod_matmul(W: np.ndarray, a: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """(W @ a) mod p for a (k_out, k_in) matrix W (row j reduced mod p[j]) and a (..., k_in, n) matrix a
+    of 32 bit words, p is the (k_out, 1) column of output moduli
+    Every product is accumulated with mod_mac (one reduction per input row)
+    """
+    acc = np.zeros(a.shape[:-2] + (W.shape[0], a.shape[-1]), dtype=np.uint64)
+    for i in range(W.shape[1]):
+        acc = mod_mac(acc, a[..., i:i+1, :], W[:, i:i+1], p)
+    return acc
+
+def mod_mul_barrett(a: np.ndarray, b: np.ndarray, p: np.ndarray, mu: np.ndarray) -> np.ndarray:
+    """(a * b) mod p with Barrett reduction, a and b in [0, p)"""
+    return barrett_reduce(a * b, p, mu)
+
+def mod_mul_shoup(a: np.ndarray, w: np.ndarray, w_shoup: np.ndarray, p: np.ndarray) -> np.ndarray:
+    """(a * w) mod p for a fixed multiplicand w with precomputed w_shoup, a in [0, 2^32)"""
+    qhat = (a * w_shoup) >> _SHIFT32
+    r = a * w - qhat * p # r in [0, 2p)
+    return _conditional_subtract(r, p)
+
+
+if __name__ == "__main__":
+    # bit-exactness check against the object dtype (Python bigint) path and a small benchmark
+    import random, time
+    primes = [257, 65537, 2147483777, 3221225473, 4294966657]
+    p = np.array(primes, dtype=np.uint64).reshape(-1, 1)
+    mu = barrett_precompute(p)
+    n = 4096
+    a, b, c = [np.array([[random.randrange(q) for _ in range(n)] for q in primes], dtype=np.uint64) for _ in range(3)]
+    a[:, 0], b[:, 0], c[:, 0] = p[:, 0] - 1, p[:, 0] - 1, p[:, 0] - 1 # worst case operands
+    ao, bo, co, po = a.astype(object), b.astype(object), c.astype(object), p.astype(object)
+    b_shoup = shoup_precompute(b, p)
+    W = np.array([[random.randrange(q) for _ in range(len(primes))] for q in primes], dtype=np.uint64)
+    checks = {
+        "mod_add": (lambda: mod_add(a, b, p), lambda: (ao + bo) % po),
+        "mod_sub": (lambda: mod_sub(a, b, p), lambda: (ao - bo) % po),
+        "mod_neg": (lambda: mod_neg(a, p), lambda: (-ao) % po),
+        "mod_mul": (lambda: mod_mul(a, b, p), lambda: (ao * bo) % po),
+        "mod_mac": (lambda: mod_mac(c, a, b, p), lambda: (co + ao * bo) % po),
+        "mod_dot": (lambda: mod_dot(a, b, p), lambda: ((ao * bo) % po).sum(axis=0) % po),
+        "mod_matmul": (lambda: mod_matmul(W, a, p), lambda: W.astype(object).dot(ao) % po),
+        "mod_mul_barrett": (lambda: mod_mul_barrett(a, b, p, mu), lambda: (ao * bo) % po),
+        "mod_mul_shoup": (lambda: mod_mul_shoup(a, b, b_shoup, p), lambda: (ao * bo) % po),
+    }
+    def timeit(f, reps):
+        start = time.perf_counter()
+        for _ in range(reps):
+            f()
+        return (time.perf_counter() - start) / reps * 1e6
+    print(f"{len(primes)} x {n} residue matrix")
+    for name, (kernel, reference) in checks.items():
+        assert np.array_equal(kernel().astype(object), reference()), f"{name} is not bit-exact"
+        print(f"{name:>16}: {timeit(kernel, 50):9.1f} us   (object dtype: {timeit(reference, 3):9.1f} us)")
@@ -0,0 +1,274 @@
+# noise_planner.py
+"""
+Pick the smallest ciphertext modulus (desired_q_numbits) and n that a computation decrypts correctly with
+
+    plan = plan_parameters(t=257, mul_depth=2, slots=64, adds_per_level=3, plain_muls_per_level=1)
+    config = BFVSchemeConfiguration(plan["t"], plan["desired_q_numbits"], plan["n"], plan["ternary"])
+    plan = plan_circuit(circuit, verify=True)       # or for a recorded circuit.Circuit (t and n are its own)
+
+Noise is the invariant noise e of a ciphertext, B + A*S = Delta*M + e mod q, decryption is correct while
+|e| < Delta/2 (see BFVSchemeClient.noise_bits). NoiseModel predicts log2 |e|_inf per operation with heuristic
+(average case, high probability) bounds of this RNS/BEHZ variant, calibrated against measured noise:
+    fresh encryption    6 sigma
+    add ct ct           e1 + e2             (add ct pt: unchanged, Delta = q/t is exact)
+    mul ct pt           4 t sqrt(n) e
+    mul ct ct           16 t n r (e1 + e2)  r = sqrt(n) (binary secret) or 1 (ternary): A*S/q is not centred
+                                             for a binary secret, its size grows like n instead of sqrt(n)
+      + relinearization 2 sigma sqrt(n sum q_i^2) (one RLev digit per q prime, digits are uniform mod q_i), added
+                        once a product is relinearized (circuits defer it past additions and ct pt products)
+The planner grows q until log2(Delta/2) exceeds the predicted noise by margin_bits. verify=True also runs the
+computation on random data with the planned parameters and measures the noise with the secret key, q is raised
+until the measured budget has the margin too.
+The BEHZ multiply of this tree needs t^2 n k^2 (k = number of q primes) well below qBBa/Q ~ 2^31: beyond it the
+ct ct product wraps around and decrypts to garbage whatever the noise budget, so such plans are rejected.
+"""
+import math
+import copy
+import argparse
+import numpy as np
+from generic_math import gen_RNS_basis, is_t_minus_1_multiple_of_2n
+from BFV_config import BFVSchemeConfiguration
+from BFV_model import BFVSchemeClient, BFVSchemeServer
+from circuit import Circuit
+
+# standard deviation of the encryption noise of BFVSchemeClient (rounded normal(0, 1))
+SIGMA = 1.0
+RESIDUE_BITS = 32
+
+class NoiseModel:
+    def __init__(self, t: int, n: int, primes, ternary: bool = True, sigma: float = SIGMA):
+        """noise growth of the ct operations for plaintext modulus t, n slots and the q primes (t included)
+        every method takes and returns noise magnitudes |e|_inf (python floats, not log2)
+        """
+        self.t, self.n, self.ternary, self.sigma = int(t), int(n), bool(ternary), float(sigma)
+        self.primes = [int(p) for p in primes]
+        self.log2_q = sum([math.log2(p) for p in self.primes])
+        # log2(Delta/2): the noise bound of a correct decryption
+        self.log2_bound = self.log2_q - math.log2(self.t) - 1
+        self.relin = 2 * self.sigma * math.sqrt(self.n * sum([float(p) ** 2 for p in self.primes]))
+
+    def fresh(self) -> float:
+        return 6 * self.sigma
+
+    def add(self, e1: float, e2: float) -> float:
+        return e1 + e2
+
+    def add_plain(self, e: float) -> float:
+        return e
+
+    def mul_plain(self, e: float) -> float:
+        return 4 * self.t * math.sqrt(self.n) * e
+
+    def tensor(self, e1: float, e2: float) -> float:
+        """degree 2 product before relinearization"""
+        r = 1.0 if self.ternary else math.sqrt(self.n)
+        return 16 * self.t * self.n * r * (e1 + e2)
+
+    def relinearize(self, e: float) -> float:
+        return e + self.relin
+
+    def mul(self, e1: float, e2: float) -> float:
+        return self.relinearize(self.tensor(e1, e2))
+
+    def budget_bits(self, e: float) -> float:
+        """bits left before decryption fails"""
+        return self.log2_bound - math.log2(e)
+
+    def behz_headroom_bits(self, residue_bits: int = RESIDUE_BITS) -> float:
+        """bits left before the ct ct product overflows qBBa (negative: mul_ciphercipher fails)"""
+        k = len(self.primes)
+        return (residue_bits - 1) - (2 * math.log2(self.t) + math.log2(self.n) + 2 * math.log2(k) + 1)
+
+
+def predict_layered(model: NoiseModel, mul_depth: int, adds_per_level: int = 0, plain_muls_per_level: int = 0) -> float:
+    """noise of layered_circuit: per level, sum of adds_per_level + 1 fresh-like ciphertexts, plain_muls_per_level
+    ct pt products, then a ct ct square (plaintext additions never add noise). Like the compiled circuit, a
+    product is only relinearized by the next square or at the output
+    """
+    e, degree2 = model.fresh(), False
+    for level in range(mul_depth + 1):
+        e = model.add(e, adds_per_level * model.fresh())
+        if level == mul_depth:
+            break
+        for _ in range(plain_muls_per_level):
+            e = model.mul_plain(e)
+        e = model.relinearize(e) if degree2 else e
+        e, degree2 = model.tensor(e, e), True
+    return model.relinearize(e) if degree2 else e
+
+def predict_circuit(model: NoiseModel, circuit: Circuit) -> dict:
+    """output name -> predicted noise of a recorded circuit, relinearized where the compiled circuit does it
+    (products stay degree 2 through additions and ct pt products unless they are also outputs or ct ct
+    multiplicands, see circuit.CompiledCircuit)
+    """
+    relinearized_nodes = set(circuit._outputs.values())
+    for op, args, _ in circuit._nodes:
+        if op == "mul_ciphercipher":
+            relinearized_nodes.update(args)
+    noise, degree2 = [], []
+    relinearized = lambda a: model.relinearize(noise[a]) if degree2[a] else noise[a]
+    operand = lambda a: relinearized(a) if a in relinearized_nodes else noise[a]
+    for op, args, _ in circuit._nodes:
+        if op == "input":
+            noise.append(model.fresh())
+        elif op == "add_ciphercipher":
+            noise.append(model.add(operand(args[0]), operand(args[1])))
+        elif op == "add_cipherplain":
+            noise.append(model.add_plain(operand(args[0])))
+        elif op == "mul_cipherplain":
+            noise.append(model.mul_plain(operand(args[0])))
+        elif op == "mul_ciphercipher":
+            noise.append(model.tensor(relinearized(args[0]), relinearized(args[1])))
+        else:
+            raise ValueError(f"unknown operation {op}")
+        degree2.append(op == "mul_ciphercipher" or any([degree2[a] and a not in relinearized_nodes for a in args]))
+    return {name: relinearized(i) for name, i in circuit._outputs.items()}
+
+
+def layered_circuit(config: BFVSchemeConfiguration, mul_depth: int, adds_per_level: int = 0, plain_muls_per_level: int = 0) -> Circuit:
+    """the op mix of predict_layered as a Circuit with random plaintexts, inputs x0 and x{level}_{j}, output "out" """
+    circuit = Circuit(config)
+    x = circuit.input("x0")
+    for level in range(mul_depth + 1):
+        for j in range(adds_per_level):
+            x = circuit.add_ciphercipher(x, circuit.input(f"x{level}_{j}"))
+        if level == mul_depth:
+            break
+        for _ in range(plain_muls_per_level):
+            x = circuit.mul_cipherplain(x, np.random.randint(1, config.t, size=config.n))
+        x = circuit.mul_ciphercipher(x, x)
+    circuit.output("out", x)
+    return circuit
+
+def _expected_outputs(circuit: Circuit, slots: dict) -> dict:
+    """output name -> plaintext slots of the circuit evaluated in the clear (mod t) on the input slots"""
+    t, values = circuit.config.t, []
+    for op, args, const in circuit._nodes:
+        x = [values[a] for a in args]
+        if op == "input":
+            values.append(slots[const])
+        elif op == "add_ciphercipher":
+            values.append((x[0] + x[1]) % t)
+        elif op == "add_cipherplain":
+            values.append((x[0] + circuit._plains[const]) % t)
+        elif op == "mul_cipherplain":
+            values.append((x[0] * circuit._plains[const]) % t)
+        else:
+            values.append((x[0] * x[1]) % t)
+    return {name: values[i] for name, i in circuit._outputs.items()}
+
+def measure_circuit(circuit: Circuit, config: BFVSchemeConfiguration) -> dict:
+    """runs circuit on random inputs with the parameters of config (same t and n as the circuit)
+    returns output name -> (measured noise bits, noise budget bits, decrypted correctly)
+    """
+    assert circuit.config.t == config.t and circuit.config.n == config.n, "config must keep the circuit's t and n"
+    circuit = copy.copy(circuit)
+    circuit.config = config
+    client, server = BFVSchemeClient(config), BFVSchemeServer(config)
+    slots = {const: np.random.randint(0, config.t, size=config.n) for op, _, const in circuit._nodes if op == "input"}
+    outputs = circuit.compile().run(server, {name: client.encrypt(P) for name, P in slots.items()}, client.relin_keys)
+    measured = dict()
+    for name, P in _expected_outputs(circuit, slots).items():
+        A, B = outputs[name]
+        noise = client.noise_bits(A, B, P)
+        correct = bool(np.array_equal(np.asarray(client.decrypt(A, B)).reshape(np.shape(P)), P))
+        measured[name] = (noise, math.log2(config.Delta // 2) - noise, correct)
+    return measured
+
+
+def _fit_q(t: int, n: int, ternary: bool, predict, margin_bits: float, qbits: int = None) -> tuple:
+    """(smallest desired_q_numbits whose q keeps margin_bits over the predicted noise, its NoiseModel, noise)"""
+    qbits = qbits or int(math.ceil(math.log2(t) + 1 + margin_bits))
+    while True:
+        primes = gen_RNS_basis(2**qbits, 2**RESIDUE_BITS, [t], n)
+        model = NoiseModel(t, n, primes, ternary)
+        noise = predict(model)
+        # q >= 2^qbits, so log2(Delta/2) >= qbits - log2(t) - 1
+        needed = int(math.ceil(math.log2(noise) + margin_bits + math.log2(t) + 1))
+        if needed <= qbits:
+            return qbits, model, noise
+        # more bits can mean more primes and more relinearization noise, so go round again
+        qbits = needed
+
+def _check_headroom(model: NoiseModel):
+    if model.behz_headroom_bits() < 0:
+        raise ValueError(f"t={model.t}, n={model.n} with {len(model.primes)} q primes overflows the BEHZ multiply "
+                         f"(t^2 n k^2 must stay below qBBa/Q ~ 2^{RESIDUE_BITS - 1}): use a smaller t, n or depth")
+
+def _plan(t: int, n: int, ternary: bool, model: NoiseModel, qbits: int, noise: float, margin_bits: float) -> dict:
+    return {"t": t, "n": n, "ternary": ternary, "desired_q_numbits": qbits, "q_primes": len(model.primes),
+            "log2_q": round(model.log2_q, 1), "predicted_noise_bits": round(math.log2(noise), 1),
+            "predicted_budget_bits": round(model.budget_bits(noise), 1), "margin_bits": margin_bits}
+
+def _verify(plan: dict, make_circuit, margin_bits: float, attempts: int) -> dict:
+    """measured mode: raise desired_q_numbits until the measured budget of every output keeps margin_bits"""
+    for _ in range(attempts):
+        config = BFVSchemeConfiguration(plan["t"], plan["desired_q_numbits"], plan["n"], plan["ternary"])
+        measured = measure_circuit(make_circuit(config), config)
+        noise = max([m[0] for m in measured.values()])
+        budget = min([m[1] for m in measured.values()])
+        plan.update({"q_primes": len(config.basis_q), "log2_q": round(math.log2(config.q), 1),
+                     "measured_noise_bits": round(noise, 1), "measured_budget_bits": round(budget, 1),
+                     "decrypts_correctly": all([m[2] for m in measured.values()])})
+        if budget >= margin_bits and plan["decrypts_correctly"]:
+            return plan
+        plan["desired_q_numbits"] += max(1, int(math.ceil(margin_bits - budget)))
+    raise ValueError(f"measured noise budget below {margin_bits} bits after {attempts} attempts: {plan}")
+
+
+def plan_parameters(t: int, mul_depth: int, slots: int, adds_per_level: int = 0, plain_muls_per_level: int = 0,
+                    margin_bits: float = 8, ternary: bool = True, verify: bool = False, attempts: int = 3) -> dict:
+    """smallest desired_q_numbits for the layered op mix of predict_layered (mul_depth ct ct levels) with margin_bits
+    of predicted noise budget left. n is not searched: it is the smallest power of two >= slots (t - 1 must be a
+    multiple of 2n), a larger n only adds noise and BEHZ load (t^2 n k^2) and security is not modelled here
+    verify=True measures the noise of layered_circuit with the plan (measured_* entries, q raised if needed)
+    returns a dict (t, n, ternary, desired_q_numbits, q_primes, log2_q, predicted and measured noise and budget)
+    """
+    t = int(t)
+    n = 1 << max(1, int(slots) - 1).bit_length()
+    if not is_t_minus_1_multiple_of_2n(t, n):
+        raise ValueError(f"no n >= {slots} with t - 1 a multiple of 2n for t={t}")
+    predict = lambda model: predict_layered(model, mul_depth, adds_per_level, plain_muls_per_level)
+    qbits, model, noise = _fit_q(t, n, ternary, predict, margin_bits)
+    if mul_depth > 0:
+        _check_headroom(model)
+    plan = _plan(t, n, ternary, model, qbits, noise, margin_bits)
+    if verify:
+        make_circuit = lambda config: layered_circuit(config, mul_depth, adds_per_level, plain_muls_per_level)
+        plan = _verify(plan, make_circuit, margin_bits, attempts)
+    return plan
+
+def plan_circuit(circuit: Circuit, margin_bits: float = 8, ternary: bool = None, verify: bool = False, attempts: int = 3) -> dict:
+    """smallest desired_q_numbits for a recorded circuit (its config fixes t and n, ternary defaults to its setting)"""
+    config = circuit.config
+    ternary = config.ternary if ternary is None else ternary
+    predict = lambda model: max(predict_circuit(model, circuit).values())
+    qbits, model, noise = _fit_q(config.t, config.n, ternary, predict, margin_bits)
+    if any([op == "mul_ciphercipher" for op, _, _ in circuit._nodes]):
+        _check_headroom(model)
+    plan = _plan(config.t, config.n, ternary, model, qbits, noise, margin_bits)
+    if verify:
+        plan = _verify(plan, lambda planned: circuit, margin_bits, attempts)
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recommend the smallest q for a BFV op mix (n is the smallest power of two >= slots).')
+    parser.add_argument('--t', type=int, default=257, help='Plaintext modulus (prime number), default: 257')
+    parser.add_argument('--slots', type=int, default=64, help='Number of slots needed (n is the smallest power of two >= slots), default: 64')
+    parser.add_argument('--depth', type=int, default=1, help='Multiplicative (ct ct) depth, default: 1')
+    parser.add_argument('--adds', type=int, default=0, help='ct ct additions per level, default: 0')
+    parser.add_argument('--plain_muls', type=int, default=0, help='ct pt multiplications per level, default: 0')
+    parser.add_argument('--margin', type=float, default=8, help='Noise budget to keep (bits), default: 8')
+    parser.add_argument('--binary', action='store_true', help='Binary secret key (run.py uses one), default: ternary')
+    parser.add_argument('--verify', action='store_true', help='Measure the noise on random data with the planned parameters')
+    args = parser.parse_args()
+
+    plan = plan_parameters(args.t, args.depth, args.slots, args.adds, args.plain_muls, args.margin, not args.binary, args.verify)
+    for key, value in plan.items():
+        print(f"{key:<24} {value}")
+    print(f"run.py --t {plan['t']} --n {plan['n']} --qbits {plan['desired_q_numbits']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# ntt.py
+import numpy as np
+from ntt_friendly_prime import _find_psi
+from generic_math import bit_reverse_perm
+from modular_kernels import mod_add, mod_sub, mod_mul
+
+class NegacyclicNTT:
+    def __init__(self, basis, n: int, psi=None):
+        """Per-residue negacyclic NTT over Z_p[x]/(x^n+1) for every prime p in basis
+        Residues are processed as a (..., k, n) uint64 matrix (row i holds the coefficients mod basis[i])
+        Every prime must satisfy 2n | p-1 and be smaller than 2^32 (so products fit in uint64)
+        psi optionally fixes the primitive 2n-th root used for each prime. The forward transform
+        evaluates at psi^(2*bitrev(i)+1) in position i
+        """
+        self.n = int(n)
+        self.basis = tuple(int(p) for p in basis)
+        assert all([(p - 1) % (2 * self.n) == 0 for p in self.basis]), "basis primes must be negacyclic NTT friendly"
+        assert all([p < 2**32 for p in self.basis]), "basis primes must fit in 32 bits"
+        self.moduli = np.array(self.basis, dtype=np.uint64).reshape(-1, 1)
+        # twiddle tables: row i holds powers of psi_i (2n-th root mod basis[i]) in bit reversed order
+        brev = bit_reverse_perm(self.n)
+        self.psi = [known_psi(p, self.n) for p in self.basis] if psi is None else [int(x) for x in psi]
+        assert all([pow(x, self.n, p) == p - 1 for x, p in zip(self.psi, self.basis)]), "psi must be a primitive 2n-th root of unity"
+        self.psi_inv = [pow(psi, -1, p) for psi, p in zip(self.psi, self.basis)]
+        self.n_inv = np.array([pow(self.n, -1, p) for p in self.basis], dtype=np.uint64).reshape(-1, 1)
+        self.psi_rev = np.array([[pow(psi, e, p) for e in brev] for psi, p in zip(self.psi, self.basis)], dtype=np.uint64)
+        self.psi_inv_rev = np.array([[pow(psi, e, p) for e in brev] for psi, p in zip(self.psi_inv, self.basis)], dtype=np.uint64)
+
+    @staticmethod
+    def is_ntt_friendly(basis, n: int) -> bool:
+        return all([(int(p) - 1) % (2 * int(n)) == 0 and int(p) < 2**32 for p in basis])
+
+    def forward(self, a: np.ndarray) -> np.ndarray:
+        """Cooley-Tukey forward NTT (psi twist merged in), natural order in -> bit reversed order out"""
+        a = np.array(a, dtype=np.uint64, copy=True)
+        lead, n = a.shape[:-1], self.n
+        p = self.moduli.reshape(-1, 1, 1)
+        m, t = 1, n
+        while m < n:
+            t //= 2
+            a = a.reshape(lead + (m, 2, t))
+            S = self.psi_rev[:, m:2*m].reshape(-1, m, 1)
+            U = a[..., 0, :]
+            V = mod_mul(a[..., 1, :], S, p)
+            a = np.stack((mod_add(U, V, p), mod_sub(U, V, p)), axis=-2)
+            m *= 2
+        return a.reshape(lead + (n,))
+
+    def inverse(self, a: np.ndarray) -> np.ndarray:
+        """Gentleman-Sande inverse NTT (psi untwist merged in), bit reversed order in -> natural order out"""
+        a = np.array(a, dtype=np.uint64, copy=True)
+        lead, n = a.shape[:-1], self.n
+        p = self.moduli.reshape(-1, 1, 1)
+        m, t = n, 1
+        while m > 1:
+            h = m // 2
+            a = a.reshape(lead + (h, 2, t))
+            S = self.psi_inv_rev[:, h:2*h].reshape(-1, h, 1)
+            U = a[..., 0, :]
+            V = a[..., 1, :]
+            a = np.stack((mod_add(U, V, p), mod_mul(mod_sub(U, V, p), S, p)), axis=-2)
+            t *= 2
+            m = h
+        return mod_mul(a.reshape(lead + (n,)), self.n_inv, self.moduli)
+
+    def pointwise_mul(self, a_hat: np.ndarray, b_hat: np.ndarray) -> np.ndarray:
+        return mod_mul(a_hat, b_hat, self.moduli)
+
+    def multiply(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """a*b mod (x^n+1) for residue matrices a and b (coefficient form in and out)"""
+        return self.inverse(self.pointwise_mul(self.forward(a), self.forward(b)))
+
+
+# primitive 2n-th roots already known for (p, n), e.g. loaded from the parameter cache (avoids the sympy root search)
+_psi_table = dict()
+
+def register_psi(n: int, psi_of_prime: dict):
+    """record psi_of_prime[p] as the 2n-th root used by every NTT engine built for prime p and length n"""
+    for p, psi in psi_of_prime.items():
+        _psi_table[(int(p), int(n))] = int(psi)
+
+def known_psi(p: int, n: int) -> int:
+    """the registered 2n-th root of unity mod p, searched for (and registered) if there is none"""
+    key = (int(p), int(n))
+    if key not in _psi_table:
+        _psi_table[key] = _find_psi(*key)
+    return _psi_table[key]
+
+# engines are shared by every polynomial living in the same (basis, n)
+_ntt_engines = dict()
+
+def get_ntt_engine(basis, n: int) -> NegacyclicNTT:
+    """returns the shared NTT engine for (basis, n), building it on first use"""
+    key = (tuple(int(p) for p in basis), int(n))
+    if key not in _ntt_engines:
+        _ntt_engines[key] = NegacyclicNTT(*key)
+    return _ntt_engines[key]
@@ -12,10 +12,11 @@ python ntt_friendly_prime.py -k 4000000 -c 100
 
 """
 
+import bisect
 from typing import Iterator, List, Tuple
 from dataclasses import dataclass
 
-import sympy
+import numpy as np
 
 @dataclass
 class NTTModulus:
@@ -32,25 +33,112 @@ class NTTModulus:
                 f"           psi^2n ≡ {pow(self.psi, 2*self.n, self.q)}")
 
 
-def _candidate_primes(n: int, start_multiple: int = 1) -> Iterator[int]:
+# small primes used to sieve a block of candidates before the (expensive) primality tests
+_SIEVE_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97,
+                 101, 103, 107, 109, 113, 127, 131, 137, 139, 149, 151, 157, 163, 167, 173, 179, 181, 191, 193, 197, 199)
+
+
+def _is_prime(x: int) -> bool:
+    from generic_math import is_prime # deferred, generic_math imports this module
+    return is_prime(x)
+
+
+class PrimePool:
     """
-    Generate numbers of the form q = k*(2n) + 1  (k ≥ start_multiple).
-    Only candidates are produced; primality is tested by the caller.
+    Growable, sorted pool of the primes of the form  start + i*step  (i >= 0).
+    Candidates are examined in blocks: a block is sieved by small primes with NumPy and
+    only the survivors get a primality test (optionally spread over a process pool).
+    The pool only ever grows, so every basis searched with the same (start, step) shares
+    the work done for the previous ones.
     """
-    k = max(start_multiple, 1)
-    step = 2 * n
-    while True:
-        yield k * step + 1
-        k += 1
+    def __init__(self, start: int, step: int, workers: int = None, block: int = 4096):
+        self.start = int(start)
+        self.step = int(step)
+        self.workers = workers
+        self.block = int(block)
+        self.primes: List[int] = []
+        self._next = 0 # index i of the first candidate not examined yet
+
+    def _candidates(self) -> List[int]:
+        """sieved candidates of the next block"""
+        lo, hi = self._next, self._next + self.block
+        self._next = hi
+        if self.start + hi * self.step >= 2**62:
+            cand = [self.start + i * self.step for i in range(lo, hi)]
+            return [c for c in cand if c > 1 and all([c % p != 0 or c == p for p in _SIEVE_PRIMES])]
+        cand = self.start + self.step * np.arange(lo, hi, dtype=np.int64)
+        keep = cand > 1
+        for p in _SIEVE_PRIMES:
+            keep &= (cand % p != 0) | (cand == p)
+        return [int(c) for c in cand[keep]]
+
+    def grow(self):
+        """examine one more block of candidates"""
+        survivors = self._candidates()
+        if self.workers is not None and self.workers > 1 and len(survivors) > 0:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                flags = list(executor.map(_is_prime, survivors, chunksize=max(1, len(survivors) // (4 * self.workers))))
+        else:
+            flags = [_is_prime(c) for c in survivors]
+        self.primes.extend([c for c, prime in zip(survivors, flags) if prime])
+
+    def prime(self, i: int) -> int:
+        """the i-th prime of the pool (searching further if needed)"""
+        while len(self.primes) <= i:
+            self.grow()
+        return self.primes[i]
+
+    def index_at_least(self, lower: int) -> int:
+        """index of the first prime >= lower (searching further if needed)"""
+        while len(self.primes) == 0 or self.primes[-1] < lower:
+            self.grow()
+        return bisect.bisect_left(self.primes, lower)
+
+    def primes_from(self, lower: int) -> Iterator[int]:
+        """every prime >= lower of the pool in increasing order (an endless iterator)"""
+        i = self.index_at_least(lower)
+        while True:
+            yield self.prime(i)
+            i += 1
+
+
+# pools are shared by every search using the same candidate progression
+_prime_pools = dict()
+
+def get_prime_pool(start: int, step: int, workers: int = None) -> PrimePool:
+    """returns the shared pool of primes start + i*step, building it on first use"""
+    key = (int(start), int(step))
+    if key not in _prime_pools:
+        _prime_pools[key] = PrimePool(*key)
+    if workers is not None:
+        _prime_pools[key].workers = workers
+    return _prime_pools[key]
+
+def clear_prime_pools():
+    """forget every pool (the next search starts from scratch)"""
+    _prime_pools.clear()
+
+def get_negacyclic_pool(n: int, start_multiple: int = 1, workers: int = None) -> PrimePool:
+    """shared pool of the negacyclic NTT friendly primes q = k*(2n) + 1  (k >= start_multiple)"""
+    return get_prime_pool(max(start_multiple, 1) * 2 * n + 1, 2 * n, workers)
 
 
 def _find_psi(q: int, n: int) -> int:
     """
     Given a prime q satisfying 2n | (q-1), return a primitive 2n-th root ψ.
-    A generator 'g' of F_q^x has order q-1; raise it to (q-1)/(2n).
+    For n a power of two, ψ = x^((q-1)/(2n)) has order dividing 2n, and that order is exactly 2n as
+    soon as ψ^n ≡ -1 (every other divisor of 2n divides n). Any quadratic non-residue x works.
+    Other n fall back to a generator 'g' of F_q^x (order q-1) raised to (q-1)/(2n).
     """
-    g = sympy.primitive_root(q)  # a generator of (Z/qZ)^×
     exponent = (q - 1) // (2 * n)
+    if n & (n - 1) == 0:
+        for x in range(2, q):
+            psi = pow(x, exponent, q)
+            if pow(psi, n, q) == q - 1:
+                return psi
+    import sympy
+    g = sympy.primitive_root(q)  # a generator of (Z/qZ)^×
     psi = pow(g, exponent, q)
     # Ensure we really obtained order 2n (might fail for small primes if g
     # is not primitive, although SymPy should give us one).  Fall back to
@@ -63,7 +151,7 @@ def _find_psi(q: int, n: int) -> int:
     return psi
 
 
-def negacyclic_moduli_internal(n: int, count: int = 5, start_multiple: int = 1) -> List[NTTModulus]:
+def negacyclic_moduli_internal(n: int, count: int = 5, start_multiple: int = 1, workers: int = None) -> List[NTTModulus]:
     """
     Search for the requested number of negacyclic-NTT friendly primes.
 
@@ -72,6 +160,7 @@ def negacyclic_moduli_internal(n: int, count: int = 5, start_multiple: int = 1)
     n              size of the NTT (degree of the negacyclic ring)
     count          how many primes to return
     start_multiple begin the search with q = (start_multiple)*(2n)+1
+    workers        if > 1, primality tests run on a process pool of that size
 
     Returns
     -------
@@ -82,25 +171,14 @@ def negacyclic_moduli_internal(n: int, count: int = 5, start_multiple: int = 1)
     if count <= 0:
         raise ValueError("count must be positive")
 
+    pool = get_negacyclic_pool(n, start_multiple, workers)
     results: List[NTTModulus] = []
-    for q in _candidate_primes(n, start_multiple):
-        if not sympy.isprime(q):
-            continue
-
+    for i in range(count):
+        q = pool.prime(i)
         psi = _find_psi(q, n)
-
-        # Check the negacyclic conditions
-        if pow(psi, n, q) != q - 1: # psi^n ≡ -1  ?
-            continue
-        if pow(psi, 2 * n, q) != 1: # psi^(2n) ≡ 1 ?
-            continue
-        if sympy.n_order(psi, q) != 2 * n: # order exactly 2n?
-            continue
-
+        assert pow(psi, n, q) == q - 1 and pow(psi, 2 * n, q) == 1, "psi is not a primitive 2n-th root"
         omega = pow(psi, 2, q) # primitive n-th root
         results.append(NTTModulus(q, psi, omega, n))
-        if len(results) >= count:
-            break
     return results
 
 
@@ -109,9 +187,9 @@ def convert_primesize_to_kmultiple(prime_size: int, scheme_SIMD_slots: int) -> i
     start_multiple = (prime_size-1)//(2*scheme_SIMD_slots)
     return start_multiple
 
-def negacyclic_moduli(n: int, count: int, prime_size: int) -> List[NTTModulus]:
+def negacyclic_moduli(n: int, count: int, prime_size: int, workers: int = None) -> List[NTTModulus]:
     start_multiple = convert_primesize_to_kmultiple(prime_size,n)
-    return negacyclic_moduli_internal(n,count,start_multiple)
+    return negacyclic_moduli_internal(n,count,start_multiple,workers)
 
 
 if __name__ == "__main__":
@@ -132,11 +210,13 @@ if __name__ == "__main__":
                         help="how many primes to list (default: 5)")
     parser.add_argument("-k", "--kstart", type=int, default=1,
                         help="start the search with q = k*(2n)+1  (default: 1)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="primality test on a pool of this many processes (worth it for large -k)")
     args = parser.parse_args()
 
     print(f"Searching for {args.count} negacyclic-NTT friendly primes "
           f"for n = {args.n} ...\n")
-    for i, modulus in enumerate(negacyclic_moduli_internal(args.n, count=args.count, start_multiple=args.kstart), 1):
+    for i, modulus in enumerate(negacyclic_moduli_internal(args.n, count=args.count, start_multiple=args.kstart, workers=args.workers), 1):
         print(f"[{i}] {modulus.q}")
         print(modulus)
         print("-" * 60)
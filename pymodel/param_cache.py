@@ -0,0 +1,59 @@
+# param_cache.py
+"""
+On-disk cache of the deterministic parameters derived by BFVSchemeConfiguration
+(RNS bases, CRT coefficients, batch encoding root and the NTT root psi of every residue prime)
+
+Entries are JSON files keyed by (t, qbits, n, residue width, format version). Every file stores its key and
+a sha256 digest of its content: a missing, corrupt or mismatching file is treated as a miss (parameters are
+recomputed and the file rewritten), so the cache can always be deleted safely.
+The directory is $BFV_PARAM_CACHE_DIR if set, else ~/.cache/bfv_pymodel
+"""
+import os
+import json
+import hashlib
+import tempfile
+
+# bump when the content (or the way it is derived) changes, old files are then simply ignored
+FORMAT_VERSION = 2
+
+def default_cache_dir() -> str:
+    return os.environ.get("BFV_PARAM_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "bfv_pymodel"))
+
+def make_key(t: int, qbits: int, n: int, residue_bits: int) -> dict:
+    return {"t": int(t), "qbits": int(qbits), "n": int(n), "residue_bits": int(residue_bits), "format_version": FORMAT_VERSION}
+
+def cache_path(key: dict, cache_dir: str = None) -> str:
+    cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+    name = f"bfv_t{key['t']}_q{key['qbits']}_n{key['n']}_r{key['residue_bits']}_v{key['format_version']}.json"
+    return os.path.join(cache_dir, name)
+
+def _digest(key: dict, params: dict) -> str:
+    canonical = json.dumps({"key": key, "params": params}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def load_params(key: dict, cache_dir: str = None):
+    """returns the cached parameter dict for key, or None on a miss (no file, unreadable, wrong key or bad digest)"""
+    try:
+        with open(cache_path(key, cache_dir), "r") as f:
+            entry = json.load(f)
+        if entry["key"] != key or entry["sha256"] != _digest(entry["key"], entry["params"]):
+            return None
+        return entry["params"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def store_params(key: dict, params: dict, cache_dir: str = None) -> bool:
+    """writes params for key (atomically, a concurrent reader sees the old file or the new one)
+    returns False if the cache directory is not writable (the cache is only an optimization)
+    """
+    path = cache_path(key, cache_dir)
+    entry = {"key": key, "params": params, "sha256": _digest(key, params)}
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,346 @@
+# rns_polynomial.py
+import numpy as np
+from collections.abc import Iterable
+from generic_math import RNSInteger, is_pairwise_coprime, gen_uniform_rand_residues, xof_uniform_residues, xof_child_seed, bit_reverse_perm
+from ntt import get_ntt_engine
+from modular_kernels import mod_add, mod_sub, mod_neg, mod_mul
+from base_conversion import get_fastBconv, get_modswitch, get_fastBconvEx, get_crt_reconstruction
+
+class RNSBasis:
+    def __init__(self, primes: Iterable[int]):
+        """A set of coprime residue moduli shared by every RNSPolynomial that lives in it
+        primes must fit in 32 bits so that the product of two residues fits in a uint64
+        """
+        self.primes = tuple(int(p) for p in primes)
+        assert len(self.primes) > 0, "basis can not be empty"
+        assert all([1 < p < 2**32 for p in self.primes]), "basis moduli must fit in 32 bits"
+        assert is_pairwise_coprime(self.primes), "residue basis must be coprime"
+        # column vector so it broadcasts against a (k, n) residue matrix
+        self.moduli = np.array(self.primes, dtype=np.uint64).reshape(-1, 1)
+        self.modulus = int(np.prod(np.array(self.primes, dtype=object)))
+        # object array form (same format as the RNS_basis_* attributes of BFVSchemeConfiguration)
+        self.basis = np.array(self.primes, dtype=object)
+
+    def __len__(self):
+        return len(self.primes)
+
+    def constant_residues(self, c: int) -> np.ndarray:
+        """the integer c as a (k, 1) residue column (broadcasts against a residue matrix)"""
+        return np.array([int(c) % p for p in self.primes], dtype=np.uint64).reshape(-1, 1)
+
+    def __iter__(self):
+        return iter(self.primes)
+
+    def __eq__(self, other):
+        return self is other or (isinstance(other, RNSBasis) and self.primes == other.primes)
+
+    def __hash__(self):
+        return hash(self.primes)
+
+    def __repr__(self):
+        return f"RNSBasis({list(self.primes)})"
+
+
+class RNSPolynomial:
+    # domain tags: coefficient form, or NTT evaluation form (per-residue forward NTT, bit reversed order)
+    COEFF = "coeff"
+    EVAL = "eval"
+
+    def __init__(self, residues: np.ndarray, basis: RNSBasis, domain: str = COEFF):
+        """A polynomial of n coefficients in RNS form
+        residues is a contiguous (k, n) uint64 matrix, row i holds every coefficient mod basis.primes[i]
+        (or every NTT evaluation mod basis.primes[i] if domain is EVAL)
+        A stack of polynomials is a (..., k, n) array (batch_shape leading dims), every operation
+        broadcasts over the batch dims (a single (k, n) polynomial broadcasts against a stack)
+        Conversions between domains are lazy and memoized: to_eval()/to_coeff() transform once and keep
+        the other form linked (_twin), so treat polynomials as immutable apart from += and -=
+        """
+        assert isinstance(basis, RNSBasis), "basis must be an RNSBasis"
+        assert domain in (RNSPolynomial.COEFF, RNSPolynomial.EVAL), "unknown polynomial domain"
+        self.basis = basis
+        self.domain = domain
+        self.residues = np.ascontiguousarray(residues, dtype=np.uint64)
+        assert self.residues.ndim >= 2 and self.residues.shape[-2] == len(basis), "residues must be a (..., k, n) matrix"
+        self._twin = None
+
+    @property
+    def n(self) -> int:
+        return self.residues.shape[-1]
+
+    @property
+    def batch_shape(self) -> tuple:
+        """leading stack dims, () for a single polynomial"""
+        return self.residues.shape[:-2]
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        batch = f", batch_shape={self.batch_shape}" if self.batch_shape else ""
+        return f"RNSPolynomial(n={self.n}, basis={list(self.basis.primes)}, domain={self.domain}{batch})"
+
+    @staticmethod
+    def zeros(basis: RNSBasis, n: int, domain: str = COEFF, batch_shape: tuple = ()) -> "RNSPolynomial":
+        return RNSPolynomial(np.zeros(tuple(batch_shape) + (len(basis), int(n)), dtype=np.uint64), basis, domain)
+
+    @staticmethod
+    def uniform(basis: RNSBasis, n: int, batch_shape: tuple = ()) -> "RNSPolynomial":
+        """n coefficients drawn uniformly mod basis.modulus (sampled residue by residue, see gen_uniform_rand_residues)"""
+        batch_shape = tuple(batch_shape)
+        residues = gen_uniform_rand_residues(basis.primes, int(np.prod(batch_shape, dtype=int)) * int(n))
+        residues = residues.reshape((len(basis),) + batch_shape + (int(n),))
+        return RNSPolynomial(np.moveaxis(residues, 0, -2), basis)
+
+    @staticmethod
+    def stack(polys: Iterable["RNSPolynomial"]) -> "RNSPolynomial":
+        """stack polynomials of one basis into a (batch, k, n) polynomial (in the domain of the first one)"""
+        polys = list(polys)
+        for P in polys[1:]:
+            polys[0]._check_basis(P)
+        domain = polys[0].domain
+        return RNSPolynomial(np.stack([P.to_domain(domain).residues for P in polys]), polys[0].basis, domain)
+
+    @staticmethod
+    def sum(polys: Iterable["RNSPolynomial"]) -> "RNSPolynomial":
+        """sum of polynomials of one basis (in the domain of the first one, batch dims broadcast) with a single
+        reduction per residue: reduced words are below 2^32, so up to 2^32 of them add up without overflow
+        """
+        polys = list(polys)
+        for P in polys[1:]:
+            polys[0]._check_basis(P)
+        domain = polys[0].domain
+        residues = np.broadcast_arrays(*[P.to_domain(domain).residues for P in polys])
+        return RNSPolynomial(np.sum(residues, axis=0, dtype=np.uint64) % polys[0].basis.moduli, polys[0].basis, domain)
+
+    def unstack(self) -> list:
+        """split a (batch, k, n) polynomial into a list of batch polynomials"""
+        assert len(self.batch_shape) == 1, "expecting a (batch, k, n) polynomial"
+        return [RNSPolynomial(r, self.basis, self.domain) for r in self.residues]
+
+    @staticmethod
+    def from_integers(ints_in: Iterable, basis: RNSBasis) -> "RNSPolynomial":
+        """Encode a length n array of (possibly negative, possibly bigint) integers into basis
+        a (batch, n) array is encoded as a (batch, k, n) stack
+        """
+        ints_in = np.asarray(ints_in)
+        if ints_in.ndim != 2:
+            ints_in = ints_in.flatten()
+        if ints_in.dtype != object and abs(int(ints_in.max(initial=0))) < 2**62 and abs(int(ints_in.min(initial=0))) < 2**62:
+            # small integers, reduce with int64 arithmetic
+            small = ints_in.astype(np.int64)[..., np.newaxis, :]
+            residues = np.mod(small, np.array(basis.primes, dtype=np.int64).reshape(-1, 1))
+        else:
+            residues = np.stack([ints_in.astype(object) % p for p in basis.primes], axis=-2)
+        return RNSPolynomial(residues.astype(np.uint64), basis)
+
+    @staticmethod
+    def from_RNSIntegers(coeffs: Iterable[RNSInteger], basis: RNSBasis) -> "RNSPolynomial":
+        """Pack an np.ndarray of RNSIntegers (all sharing basis) into a residue matrix"""
+        return RNSPolynomial(np.array([coef.residues for coef in coeffs], dtype=np.uint64).T, basis)
+
+    def to_RNSIntegers(self) -> np.ndarray:
+        """Unpack into an np.ndarray of RNSIntegers (one per coefficient)"""
+        assert self.batch_shape == (), "RNSIntegers only represent a single polynomial"
+        res = np.empty(self.n, dtype=object)
+        columns = self.to_coeff().residues.T.astype(object)
+        for i in range(self.n):
+            res[i] = RNSInteger(0, self.basis.basis, self.basis.modulus)
+            res[i].residues = columns[i]
+        return res
+
+    def to_integers(self, centered: bool = False) -> np.ndarray:
+        """Reconstruct every coefficient as an integer in [0, modulus), or in (-modulus/2, modulus/2] if centered
+        (one vectorized CRT pass, see base_conversion.CRTReconstruction)
+        """
+        return get_crt_reconstruction(self.basis).reconstruct(self.to_coeff().residues, centered)
+
+    def copy(self) -> "RNSPolynomial":
+        return RNSPolynomial(self.residues.copy(), self.basis, self.domain)
+
+    def _ntt_engine(self):
+        return get_ntt_engine(self.basis.primes, self.n)
+
+    def to_eval(self) -> "RNSPolynomial":
+        """NTT evaluation form of this polynomial (transformed once, then memoized)"""
+        if self.domain == RNSPolynomial.EVAL:
+            return self
+        if self._twin is None:
+            self._twin = RNSPolynomial(self._ntt_engine().forward(self.residues), self.basis, RNSPolynomial.EVAL)
+            self._twin._twin = self
+        return self._twin
+
+    def to_coeff(self) -> "RNSPolynomial":
+        """coefficient form of this polynomial (transformed once, then memoized)"""
+        if self.domain == RNSPolynomial.COEFF:
+            return self
+        if self._twin is None:
+            self._twin = RNSPolynomial(self._ntt_engine().inverse(self.residues), self.basis, RNSPolynomial.COEFF)
+            self._twin._twin = self
+        return self._twin
+
+    def to_domain(self, domain: str) -> "RNSPolynomial":
+        return self.to_eval() if domain == RNSPolynomial.EVAL else self.to_coeff()
+
+    def _detach(self):
+        """forget the memoized other-domain form (called before an in place update)"""
+        if self._twin is not None:
+            self._twin._twin = None
+            self._twin = None
+
+    def _check_basis(self, other):
+        assert isinstance(other, RNSPolynomial), "expecting RNSPolynomial"
+        assert self.basis == other.basis, "Basis mismatch"
+        assert self.n == other.n, "polynomial length mismatch"
+
+    # add/sub work in either domain, a mismatched operand is brought into the domain of self
+    def __add__(self, other):
+        self._check_basis(other)
+        other = other.to_domain(self.domain)
+        return RNSPolynomial(mod_add(self.residues, other.residues, self.basis.moduli), self.basis, self.domain)
+
+    def __sub__(self, other):
+        self._check_basis(other)
+        other = other.to_domain(self.domain)
+        return RNSPolynomial(mod_sub(self.residues, other.residues, self.basis.moduli), self.basis, self.domain)
+
+    def __neg__(self):
+        return RNSPolynomial(mod_neg(self.residues, self.basis.moduli), self.basis, self.domain)
+
+    def __iadd__(self, other):
+        self._check_basis(other)
+        other = other.to_domain(self.domain)
+        self._detach()
+        self.residues = mod_add(self.residues, other.residues, self.basis.moduli)
+        return self
+
+    def __isub__(self, other):
+        self._check_basis(other)
+        other = other.to_domain(self.domain)
+        self._detach()
+        self.residues = mod_sub(self.residues, other.residues, self.basis.moduli)
+        return self
+
+    def __mul__(self, other):
+        """negacyclic polynomial product mod (x^n+1): pointwise product of the NTT evaluation forms
+        The result stays in evaluation form (call to_coeff() when coefficients are needed)
+        """
+        self._check_basis(other)
+        engine = self._ntt_engine()
+        return RNSPolynomial(engine.pointwise_mul(self.to_eval().residues, other.to_eval().residues), self.basis, RNSPolynomial.EVAL)
+
+    def automorphism(self, g: int) -> "RNSPolynomial":
+        """Galois automorphism a(x) -> a(x^g) mod (x^n+1) for odd g, in the domain of self
+        coefficient form: coefficient i moves to i*g mod 2n (negated past n), evaluation form: a permutation
+        of the evaluations (position p holds a(psi^(2*bitrev(p)+1)), which becomes a(psi^((2*bitrev(p)+1)*g)))
+        """
+        dest, negate, eval_perm = _automorphism_tables(self.n, g)
+        if self.domain == RNSPolynomial.EVAL:
+            return RNSPolynomial(self.residues[..., eval_perm], self.basis, self.domain)
+        moved = np.where(negate, mod_neg(self.residues, self.basis.moduli), self.residues)
+        out = np.empty_like(moved)
+        out[..., dest] = moved
+        return RNSPolynomial(out, self.basis, self.domain)
+
+    def mul_constant(self, c: int) -> "RNSPolynomial":
+        """multiply every coefficient by the integer c (works in either domain, the NTT is linear)"""
+        return self.mul_constant_residues(self.basis.constant_residues(c))
+
+    def mul_constant_residues(self, c_residues: np.ndarray) -> "RNSPolynomial":
+        """multiply by a constant given as its precomputed (k, 1) residue column (see RNSBasis.constant_residues)"""
+        return RNSPolynomial(mod_mul(self.residues, c_residues, self.basis.moduli), self.basis, self.domain)
+
+    def fastBconv(self, target_basis: RNSBasis) -> "RNSPolynomial":
+        """Fast base conversion of the whole polynomial (RNSInteger.fastBconv applied to every coefficient)"""
+        converter = get_fastBconv(self.basis, target_basis)
+        return RNSPolynomial(converter.convert(self.to_coeff().residues), target_basis)
+
+    def modswitch(self, target_basis: RNSBasis) -> "RNSPolynomial":
+        """modswitch to the subset target_basis (drops every other residue), like RNSInteger.modswitch"""
+        return RNSPolynomial(get_modswitch(self.basis, target_basis).convert(self.to_coeff().residues), target_basis)
+
+    def moddrop(self, target_basis: RNSBasis) -> "RNSPolynomial":
+        """keeps the residues of the subset target_basis (the same polynomial mod a divisor), in either domain"""
+        rows = [self.basis.primes.index(p) for p in target_basis.primes]
+        return RNSPolynomial(self.residues[..., rows, :], target_basis, self.domain)
+
+    def fastBconvEx(self, aux_basis_B: RNSBasis, aux_basis_Ba: RNSBasis, target_basis: RNSBasis) -> "RNSPolynomial":
+        """exact fast base conversion from B union Ba (= self.basis) to target_basis, like RNSInteger.fastBconvEx"""
+        return RNSPolynomial(get_fastBconvEx(self.basis, aux_basis_B, aux_basis_Ba, target_basis).convert(self.to_coeff().residues), target_basis)
+
+
+class SeededRNSPolynomial(RNSPolynomial):
+    def __init__(self, seed: bytes, basis: RNSBasis, n: int, batch_shape: tuple = ()):
+        """Uniform polynomial mod basis.modulus (coefficient form) described by its XOF seed: the residues are
+        expanded (xof_uniform_residues, polynomial b of a stack from xof_child_seed(seed, b)) on first use, so a
+        fresh ciphertext or key can be stored and sent as its seed in place of A
+        seed is None once the residues were updated in place (the polynomial then behaves as a RNSPolynomial)
+        """
+        assert isinstance(basis, RNSBasis), "basis must be an RNSBasis"
+        self.basis = basis
+        self.domain = RNSPolynomial.COEFF
+        self.seed = bytes(seed)
+        self._n = int(n)
+        self._batch_shape = tuple(batch_shape)
+        self._residues = None
+        self._twin = None
+
+    @staticmethod
+    def expand(seed: bytes, basis: RNSBasis, n: int, batch_shape: tuple = ()) -> np.ndarray:
+        batch_shape = tuple(batch_shape)
+        if batch_shape == ():
+            return xof_uniform_residues(seed, basis.primes, n)
+        count = int(np.prod(batch_shape, dtype=int))
+        return np.stack([xof_uniform_residues(xof_child_seed(seed, b), basis.primes, n) for b in range(count)]).reshape(batch_shape + (len(basis), n))
+
+    @property
+    def residues(self) -> np.ndarray:
+        if self._residues is None:
+            self._residues = SeededRNSPolynomial.expand(self.seed, self.basis, self._n, self._batch_shape)
+        return self._residues
+
+    @residues.setter
+    def residues(self, value: np.ndarray):
+        self._residues = value
+        self.seed = None
+
+    @property
+    def expanded(self) -> bool:
+        return self._residues is not None
+
+    @property
+    def n(self) -> int:
+        return self._n
+
+    @property
+    def batch_shape(self) -> tuple:
+        return self._batch_shape if self.seed is not None else self.residues.shape[:-2]
+
+    def unstack(self) -> list:
+        """split a (batch, k, n) stack, the parts keep their (child) seeds and share the expanded residues"""
+        assert len(self.batch_shape) == 1, "expecting a (batch, k, n) polynomial"
+        if self.seed is None:
+            return super().unstack()
+        parts = [SeededRNSPolynomial(xof_child_seed(self.seed, b), self.basis, self._n) for b in range(self._batch_shape[0])]
+        if self._residues is not None:
+            for part, r in zip(parts, self._residues):
+                part._residues = r
+        return parts
+
+    def __repr__(self):
+        return "Seeded" + super().__repr__() if self.expanded else f"SeededRNSPolynomial(n={self.n}, seed={self.seed.hex()[:16]}..., batch_shape={self._batch_shape})"
+
+
+# automorphism index tables by (n, g): coefficient destinations, their signs and the evaluation form permutation
+_automorphism_table_cache = dict()
+
+def _automorphism_tables(n: int, g: int) -> tuple:
+    key = (int(n), int(g) % (2 * int(n)))
+    if key not in _automorphism_table_cache:
+        n, g = key
+        assert g % 2 == 1, "Galois elements must be odd"
+        images = (np.arange(n) * g) % (2 * n)
+        brev = np.array(bit_reverse_perm(n))
+        # evaluation position p holds exponent 2*brev(p)+1, exponent e sits at position brev((e-1)/2)
+        eval_perm = brev[(((2 * brev + 1) * g) % (2 * n) - 1) // 2]
+        _automorphism_table_cache[key] = (images % n, images >= n, eval_perm)
+    return _automorphism_table_cache[key]
@@ -71,7 +71,7 @@ def generate_test_vectors(n, low=0, high=100):
 
 
 def as_sv_array(name: str, residuesin, lenname: str):
-    arr = [[element for element in row.residues] for row in residuesin]
+    arr = [[int(element) for element in row] for row in residuesin.to_coeff().residues.T]
     rows = []
     for row in arr:
         rows.append("'{" + ", ".join(str(x) for x in row) + "}")
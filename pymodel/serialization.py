@@ -0,0 +1,204 @@
+# serialization.py
+"""
+Versioned binary format for ciphertexts, relinearization keys and Galois keys
+
+    magic (8 bytes) | header length (uint32 LE) | JSON header, space padded to a 64 byte boundary | limb matrix
+
+The JSON header records the format version, the kind of object, the parameter fingerprint (sha256 of t, n and
+the q primes), the limb dtype and the shape of the limb matrix. The limb matrix holds the coefficient form
+residues as one contiguous little-endian uint32 (default, every prime is below 2^32) or uint64 array:
+    ciphertext  (2, *batch, k, n)            A then B
+    relin keys  (2, num_digits, k, n)        A keys then B keys (the stack BFVSchemeServer.load_relin_keys builds)
+    Galois keys (num_elements, 2, num_digits, k, n), the elements are listed in the header
+Seed compressed objects (A halves that are SeededRNSPolynomials, see BFVSchemeClient(seeded=True)) store the
+hex seeds in the header ("seeds") and only the B limbs (leading dim 1 in place of 2), half the size; loading
+returns SeededRNSPolynomials that expand A on first use
+Ciphertexts switched down a modulus chain (BFVSchemeServer.mod_switch_down) record their level ("level") and
+only have the limbs of its q primes, the fingerprint is the one of the level configuration
+Loading maps the limb matrix with np.memmap (no per-coefficient parsing), uint64 files are used in place
+as the residue arrays of the returned polynomials (read only, no copy). The save_* functions write uint64 limbs
+by default for that reason; uint32 files (half the size, the default of ciphertext_to_bytes for the wire) are
+widened with one copy, so memory mapping one warns
+"""
+import json
+import hashlib
+import warnings
+import numpy as np
+from rns_polynomial import RNSPolynomial, SeededRNSPolynomial
+
+MAGIC = b"BFVRNS\x00\x00"
+# version 2 added the seeds of seed compressed objects, version 3 the level of mod switched ciphertexts
+# (older files are still read)
+FORMAT_VERSION = 3
+_READABLE_VERSIONS = (1, 2, 3)
+_ALIGN = 64
+_LIMB_DTYPES = {"<u4": np.dtype("<u4"), "<u8": np.dtype("<u8")}
+
+def parameter_fingerprint(config) -> str:
+    """sha256 of the parameters a serialized object is only valid for (t, n and the q primes)"""
+    canonical = json.dumps({"t": int(config.t), "n": int(config.n), "q": [int(p) for p in config.basis_q.primes]}, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def _encode(kind: str, limbs: np.ndarray, config, limb_dtype=np.uint32, **extra) -> tuple:
+    """(header bytes, little-endian limb matrix)"""
+    dtype = np.dtype(limb_dtype).newbyteorder("<")
+    assert dtype.str in _LIMB_DTYPES, "limbs are stored as uint32 or uint64"
+    header = {"format_version": FORMAT_VERSION, "kind": kind, "fingerprint": parameter_fingerprint(config),
+              "dtype": dtype.str, "shape": [int(d) for d in limbs.shape], **extra}
+    body = json.dumps(header).encode()
+    # data offset aligned for the memory map
+    pad = -(len(MAGIC) + 4 + len(body)) % _ALIGN
+    prefix = MAGIC + np.uint32(len(body) + pad).astype("<u4").tobytes() + body + b" " * pad
+    return prefix, np.ascontiguousarray(limbs, dtype=dtype)
+
+def _header_end(data) -> int:
+    """offset of the limb matrix in data (which starts with at least the magic and the header length)"""
+    view = memoryview(data)
+    if len(view) < len(MAGIC) + 4:
+        raise ValueError("truncated header")
+    return len(MAGIC) + 4 + int(np.frombuffer(view[len(MAGIC):len(MAGIC) + 4], dtype="<u4")[0])
+
+def _decode_header(prefix: bytes, kind: str, config) -> tuple:
+    """(header dict, data offset) of a serialized object, checked against kind and config"""
+    if prefix[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a serialized BFV object")
+    length = int(np.frombuffer(prefix[len(MAGIC):len(MAGIC) + 4], dtype="<u4")[0])
+    offset = len(MAGIC) + 4 + length
+    if len(prefix) < offset:
+        raise ValueError("truncated header")
+    header = json.loads(prefix[len(MAGIC) + 4:offset].decode())
+    if header.get("format_version") not in _READABLE_VERSIONS:
+        raise ValueError(f"unsupported format version {header.get('format_version')}")
+    if header.get("kind") != kind:
+        raise ValueError(f"expecting a serialized {kind}, got {header.get('kind')}")
+    if header.get("fingerprint") != parameter_fingerprint(_level_config(header, config)):
+        raise ValueError("the serialized object was made for different BFV parameters")
+    if header.get("dtype") not in _LIMB_DTYPES:
+        raise ValueError(f"unknown limb dtype {header.get('dtype')}")
+    return header, offset
+
+def _level_config(header: dict, config):
+    """configuration of the modulus chain level a ciphertext was saved at"""
+    if header.get("level") is None:
+        return config
+    if not 0 <= header["level"] <= config.max_level:
+        raise ValueError(f"the serialized ciphertext is at level {header['level']}, the configuration has no such level")
+    return config.at_level(header["level"])
+
+def _save(path: str, kind: str, limbs: np.ndarray, config, limb_dtype=np.uint64, **extra):
+    prefix, limbs = _encode(kind, limbs, config, limb_dtype, **extra)
+    with open(path, "wb") as f:
+        f.write(prefix)
+        f.write(limbs.data)
+
+def _load(path: str, kind: str, config, mmap: bool = True) -> tuple:
+    """(header, uint64 limb matrix), memory mapped (read only) if mmap"""
+    with open(path, "rb") as f:
+        prefix = f.read(len(MAGIC) + 4)
+        prefix += f.read(_header_end(prefix) - len(prefix))
+    header, offset = _decode_header(prefix, kind, config)
+    dtype, shape = _LIMB_DTYPES[header["dtype"]], tuple(header["shape"])
+    if mmap:
+        if dtype != np.uint64:
+            warnings.warn(f"{path} has {dtype} limbs, memory mapping it still widens them with a full copy "
+                          "(save with limb_dtype=np.uint64 for zero-copy loading)", stacklevel=3)
+        limbs = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    else:
+        limbs = np.fromfile(path, dtype=dtype, offset=offset, count=int(np.prod(shape, dtype=np.int64))).reshape(shape)
+    return header, _as_residues(limbs)
+
+def _as_residues(limbs: np.ndarray) -> np.ndarray:
+    # native uint64 limbs are used as they are (no copy), anything else is widened once
+    return limbs if limbs.dtype == np.uint64 else limbs.astype(np.uint64)
+
+def _check_limbs(limbs: np.ndarray, config):
+    if limbs.shape[-2:] != (len(config.basis_q), config.n):
+        raise ValueError("limb matrix does not match the q basis")
+
+def _seed(A):
+    """hex seed of A if it is still described by one"""
+    return A.seed.hex() if isinstance(A, SeededRNSPolynomial) and A.seed is not None else None
+
+def _key_seeds(keys):
+    """seeds of the A keys of a key list [(A_i, B_i)], None unless they all have one"""
+    seeds = [_seed(A) for A, _ in keys]
+    return None if None in seeds else seeds
+
+def _key_limbs(keys, seeded: bool) -> np.ndarray:
+    """(2, num_digits, k, n) coefficient residues of a key list [(A_i, B_i)], or the (1, num_digits, k, n) B residues if seeded"""
+    halves = [[B for _, B in keys]] if seeded else list(zip(*keys))
+    return np.stack([np.stack([P.to_coeff().residues for P in half]) for half in halves])
+
+def _key_list(limbs: np.ndarray, seeds, config) -> list:
+    B_keys = [RNSPolynomial(B, config.basis_q) for B in limbs[-1]]
+    if seeds is None:
+        A_keys = [RNSPolynomial(A, config.basis_q) for A in limbs[0]]
+    else:
+        A_keys = [SeededRNSPolynomial(bytes.fromhex(seed), config.basis_q, config.n) for seed in seeds]
+    return list(zip(A_keys, B_keys))
+
+def _ciphertext(header: dict, limbs: np.ndarray, config):
+    config = _level_config(header, config)
+    _check_limbs(limbs, config)
+    B = RNSPolynomial(limbs[-1], config.basis_q)
+    if header.get("seeds") is None:
+        return RNSPolynomial(limbs[0], config.basis_q), B
+    return SeededRNSPolynomial(bytes.fromhex(header["seeds"]), config.basis_q, config.n, B.batch_shape), B
+
+# ciphertexts
+def ciphertext_to_bytes(A, B, config, limb_dtype=np.uint32) -> bytes:
+    """ciphertext (A, B) in the binary format (seed compressed if A has a seed and the shape of B)
+    A ciphertext below the top of the modulus chain of config is written at its level
+    """
+    top, config = config, config.config_of(A)
+    config.validate_AB(A, B)
+    seed = _seed(A) if A.batch_shape == B.batch_shape else None
+    if seed is None:
+        limbs = np.stack(np.broadcast_arrays(A.to_coeff().residues, B.to_coeff().residues))
+    else:
+        limbs = B.to_coeff().residues[np.newaxis]
+    level = config.level if config is not top else None
+    prefix, limbs = _encode("ciphertext", limbs, config, limb_dtype, seeds=seed, level=level)
+    return prefix + limbs.tobytes()
+
+def ciphertext_from_bytes(data, config):
+    """(A, B) from ciphertext_to_bytes output (any bytes-like object, uint64 limbs are not copied)"""
+    header, offset = _decode_header(bytes(memoryview(data)[:_header_end(data)]), "ciphertext", config)
+    dtype, shape = _LIMB_DTYPES[header["dtype"]], tuple(header["shape"])
+    limbs = _as_residues(np.frombuffer(data, dtype=dtype, count=int(np.prod(shape, dtype=np.int64)), offset=offset).reshape(shape))
+    return _ciphertext(header, limbs, config)
+
+def save_ciphertext(path: str, A, B, config, limb_dtype=np.uint64):
+    """writes ciphertext (A, B) (single or stacked) to path"""
+    with open(path, "wb") as f:
+        f.write(ciphertext_to_bytes(A, B, config, limb_dtype))
+
+def load_ciphertext(path: str, config, mmap: bool = True):
+    return _ciphertext(*_load(path, "ciphertext", config, mmap), config)
+
+# relinearization keys
+def save_relin_keys(path: str, RLev, config, limb_dtype=np.uint64):
+    """writes the key list [(A_i, B_i)] of BFVSchemeClient.relin_keys to path"""
+    seeds = _key_seeds(RLev)
+    _save(path, "relin_keys", _key_limbs(RLev, seeds is not None), config, limb_dtype, seeds=seeds)
+
+def load_relin_keys(path: str, config, mmap: bool = True) -> list:
+    header, limbs = _load(path, "relin_keys", config, mmap)
+    _check_limbs(limbs, config)
+    return _key_list(limbs, header.get("seeds"), config)
+
+# Galois keys
+def save_galois_keys(path: str, galois_keys: dict, config, limb_dtype=np.uint64):
+    """writes the {g: key list} dict of BFVSchemeClient.gen_galois_keys to path"""
+    elements = sorted(galois_keys)
+    # seed compression is all or nothing (one limb matrix layout)
+    seeds = [_key_seeds(galois_keys[g]) for g in elements]
+    seeds = None if None in seeds else seeds
+    limbs = np.stack([_key_limbs(galois_keys[g], seeds is not None) for g in elements])
+    _save(path, "galois_keys", limbs, config, limb_dtype, galois_elements=[int(g) for g in elements], seeds=seeds)
+
+def load_galois_keys(path: str, config, mmap: bool = True) -> dict:
+    header, limbs = _load(path, "galois_keys", config, mmap)
+    _check_limbs(limbs, config)
+    seeds = header.get("seeds") or [None] * len(header["galois_elements"])
+    return {int(g): _key_list(limbs[i], seeds[i], config) for i, g in enumerate(header["galois_elements"])}
@@ -0,0 +1,101 @@
+# streaming.py
+"""
+Generator pipeline that encrypts (and decrypts) unbounded streams of sensor readings
+
+    for payload, count in encrypt_stream(client, readings, stats=stats):
+        send(payload)                                   # serialized (batch, k, n) ciphertext of count readings
+    for values in decrypt_stream(client, received):     # received yields the (payload, count) pairs
+        consume(values)
+
+Readings are pulled lazily and chunked into n slot plaintexts, batch plaintexts are encrypted per task
+(encode, encrypt_batch and serialization run on a worker thread, so the stages of consecutive batches
+overlap). At most max_in_flight tasks exist at a time and a new one is only started when the consumer takes
+a result, so memory stays bounded whatever the stream length and a slow consumer throttles the input.
+Results are yielded in stream order. Readings are slot values, so they come back mod t
+"""
+import time
+import itertools
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import serialization
+
+class StreamStats:
+    def __init__(self):
+        """readings (slots that carry data) processed by a stream and its wall clock time, updated as it runs
+        (the time includes the consumer, as it throttles the pipeline)
+        """
+        self.readings = 0
+        self.ciphertexts = 0
+        self.seconds = 0.0
+
+    @property
+    def readings_per_second(self) -> float:
+        return self.readings / self.seconds if self.seconds > 0 else 0.0
+
+    def __repr__(self):
+        return f"StreamStats(readings={self.readings}, ciphertexts={self.ciphertexts}, {self.readings_per_second:.0f} readings/s)"
+
+
+def chunk_readings(readings, n: int, batch: int = 1):
+    """yields ((batch, n) int64 plaintext slots, number of readings) from any iterable of readings
+    the last chunk is zero padded (fewer rows and a partly filled last row)
+    """
+    it = iter(readings)
+    while True:
+        chunk = np.fromiter(itertools.islice(it, batch * n), dtype=np.int64)
+        if len(chunk) == 0:
+            return
+        rows = -(-len(chunk) // n)
+        slots = np.zeros(rows * n, dtype=np.int64)
+        slots[:len(chunk)] = chunk
+        yield slots.reshape(rows, n), len(chunk)
+
+
+def _pipeline(tasks, work, workers: int, max_in_flight: int):
+    """yields work(task) for every task in order, with at most max_in_flight submitted and not yet consumed"""
+    assert workers >= 1 and max_in_flight >= 1, "need at least one worker and one task in flight"
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(pool.submit(work, task))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def encrypt_stream(client, readings, batch: int = 8, workers: int = 2, max_in_flight: int = 4, serialize: bool = True, stats: StreamStats = None):
+    """encrypts readings (any iterable, possibly unbounded) with client, batch plaintexts of n slots per ciphertext
+    yields (payload, count): payload is the serialized ciphertext (bytes, see serialization.ciphertext_to_bytes)
+    or the (A, B) stack if not serialize, count the number of readings it carries (the rest of the slots are 0)
+    """
+    config = client.config
+    def work(chunk):
+        slots, count = chunk
+        A, B = client.encrypt_batch(slots)
+        return (serialization.ciphertext_to_bytes(A, B, config) if serialize else (A, B)), count
+    yield from _timed(_pipeline(chunk_readings(readings, config.n, batch), work, workers, max_in_flight), stats)
+
+
+def decrypt_stream(client, ciphertexts, workers: int = 2, max_in_flight: int = 4, stats: StreamStats = None):
+    """mirror of encrypt_stream: decrypts the (payload, count) pairs it yields (bytes or (A, B) payloads) and
+    yields the count readings of each one as an int64 array
+    """
+    config = client.config
+    def work(item):
+        payload, count = item
+        A, B = serialization.ciphertext_from_bytes(payload, config) if isinstance(payload, (bytes, bytearray, memoryview)) else payload
+        return np.asarray(client.decrypt_batch(A, B)).astype(np.int64).reshape(-1)[:count], count
+    yield from (values for values, _ in _timed(_pipeline(ciphertexts, work, workers, max_in_flight), stats))
+
+
+def _timed(results, stats: StreamStats):
+    """passes (result, count) pairs through, stats get the counts and the wall clock time since the first request"""
+    start = time.perf_counter()
+    for result, count in results:
+        if stats is not None:
+            stats.readings += count
+            stats.ciphertexts += 1
+            stats.seconds = time.perf_counter() - start
+        yield result, count